@@ -0,0 +1,100 @@
+import statistics
+import threading
+
+import metrics
+
+# How fast the latency baseline of a kind of request rises to slower latencies, small so the baseline stays
+# near the latency of the unloaded service and only follows lasting changes. Faster latencies are taken at once.
+LATENCY_SMOOTHING = 0.002
+
+# Fewest requests a limit looks at before it changes
+MIN_WINDOW = 10
+
+
+class AdaptiveLimit:
+    # AIMD limit of the requests in flight to one service, like the congestion window of TCP.
+    # After every window of requests (the current limit, at least MIN_WINDOW) the limit is
+    #   - halved (backoff_ratio) when more than max_error_rate of the requests failed,
+    #   - lowered by latency_backoff_ratio when the median request took more than latency_tolerance times its
+    #     baseline latency,
+    #   - raised by one otherwise, when the window used the whole limit.
+    # The baseline is the lowest latency per kind of request, rising slowly, so slow and fast requests can share
+    # one limit. The current limit is reported as the gauge <name>_concurrency_limit.
+    # A limit with min_limit == max_limit is a fixed limit. Safe to use from threads, async callers use
+    # try_acquire (see api_fetcher).
+    def __init__(self, name, initial_limit=10, min_limit=1, max_limit=100, latency_tolerance=1.5,
+                 max_error_rate=0.05, backoff_ratio=0.5, latency_backoff_ratio=0.9):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = min(max(initial_limit, min_limit), max_limit)
+        self.latency_tolerance = latency_tolerance
+        self.max_error_rate = max_error_rate
+        self.backoff_ratio = backoff_ratio
+        self.latency_backoff_ratio = latency_backoff_ratio
+        self.in_flight = 0
+        self.baselines = {}
+        self.reset_window()
+        self.condition = threading.Condition()
+        metrics.gauge(f"{self.name}_concurrency_limit", self.limit)
+
+    def reset_window(self):
+        self.window_count = 0
+        self.window_failures = 0
+        self.window_latency_ratios = []
+        self.window_max_in_flight = self.in_flight
+
+    def try_acquire(self):
+        # Takes a slot when one is free, returns whether it got one
+        with self.condition:
+            if self.in_flight >= self.limit:
+                return False
+            self.in_flight += 1
+            self.window_max_in_flight = max(self.window_max_in_flight, self.in_flight)
+            return True
+
+    def acquire(self):
+        # Waits for a free slot
+        with self.condition:
+            while self.in_flight >= self.limit:
+                self.condition.wait()
+            self.in_flight += 1
+            self.window_max_in_flight = max(self.window_max_in_flight, self.in_flight)
+
+    def release(self, latency, failed=False, kind=None):
+        # Gives the slot back with the outcome of the request: its latency in seconds and whether it failed
+        # in a way that more load makes worse (timeouts, 429, 5xx, broken connections)
+        with self.condition:
+            self.in_flight -= 1
+            self.add_sample(latency, failed, kind)
+            self.condition.notify_all()
+
+    def add_sample(self, latency, failed, kind):
+        self.window_count += 1
+        if failed:
+            self.window_failures += 1
+        else:
+            baseline = self.baselines.get(kind)
+            if baseline is None or baseline <= 0:
+                baseline = latency
+            self.window_latency_ratios.append(latency / baseline if baseline > 0 else 1.0)
+            self.baselines[kind] = min(latency, baseline + LATENCY_SMOOTHING * (latency - baseline))
+        if self.window_count < max(self.limit, MIN_WINDOW):
+            return
+
+        # The median, so a few slow requests (a new connection, a GC pause) do not lower the limit
+        latency_ratio = statistics.median(self.window_latency_ratios) if self.window_latency_ratios else 0.0
+        if self.window_failures / self.window_count > self.max_error_rate:
+            new_limit = int(self.limit * self.backoff_ratio)
+        elif latency_ratio > self.latency_tolerance:
+            new_limit = int(self.limit * self.latency_backoff_ratio)
+        elif self.window_max_in_flight >= self.limit:
+            new_limit = self.limit + 1
+        else:
+            # The limit was not reached, raising it would not say anything about the service
+            new_limit = self.limit
+        new_limit = min(max(new_limit, self.min_limit), self.max_limit)
+        if new_limit != self.limit:
+            self.limit = new_limit
+            metrics.gauge(f"{self.name}_concurrency_limit", self.limit)
+        self.reset_window()
@@ -0,0 +1,183 @@
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from adaptive_limit import AdaptiveLimit
+from token_provider import TokenProvider, TokenError
+from resilience import RetryPolicy, RETRY_STATUSES, CONNECT_TIMEOUT, READ_TIMEOUT, get_breaker, parse_retry_after
+import metrics
+
+
+MATCH_ENDPOINT = "/api/v1/wyscout/matches/{match_id}"
+
+# Returned instead of the payload when the API answered 304 to an If-None-Match request
+NOT_MODIFIED = "not modified"
+
+
+class RateLimiter:
+    # Spaces requests out so there are at most rate_per_second requests per second, None means no limit
+    def __init__(self, rate_per_second=None):
+        self.interval = 1.0 / rate_per_second if rate_per_second else 0.0
+        self.next_time = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self.lock:
+            now = asyncio.get_running_loop().time()
+            if self.next_time > now:
+                await asyncio.sleep(self.next_time - now)
+                now = self.next_time
+            self.next_time = now + self.interval
+
+
+class AsyncMatchFetcher:
+    # Fetches matches concurrently over one pooled keep-alive session.
+    # Use as: async with AsyncMatchFetcher(base_url, token) as fetcher: await fetcher.fetch_matches(ids)
+    # token is either a fixed token or a TokenProvider, the provider is asked again for every request.
+    # Timeouts, connection errors, 429 and 5xx are retried with retry_policy, a 401 gets a new token once.
+    # All requests share the "api" circuit breaker, so fetching pauses while the API is down.
+    # The requests in flight are bounded by limit, an AdaptiveLimit that can be shared by the fetchers of
+    # several chunks so it keeps what it learned about the API. Without a limit concurrency is a fixed limit.
+    def __init__(self, base_url, token, concurrency=10, rate_per_host=None, keepalive_timeout=30, retry_policy=None,
+                 limit=None):
+        self.base_url = base_url
+        self.token = token
+        self.limit = limit or AdaptiveLimit("api", concurrency, concurrency, concurrency)
+        self.rate_per_host = rate_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breaker = get_breaker("api")
+        self.session = None
+        self.slots = None
+        self.rate_limiters = {}
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.limit.max_limit, limit_per_host=self.limit.max_limit,
+                                         keepalive_timeout=self.keepalive_timeout)
+        timeout = aiohttp.ClientTimeout(total=None, connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        self.slots = asyncio.Condition()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.session.close()
+        self.session = None
+
+    def get_rate_limiter(self, url):
+        host = urlsplit(url).netloc
+        if host not in self.rate_limiters:
+            self.rate_limiters[host] = RateLimiter(self.rate_per_host)
+        return self.rate_limiters[host]
+
+    async def get_headers(self):
+        token = self.token
+        if isinstance(token, TokenProvider):
+            token = await token.get_token_async()
+        return {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json",
+        }
+
+    async def acquire_slot(self):
+        async with self.slots:
+            await self.slots.wait_for(self.limit.try_acquire)
+
+    async def release_slot(self, latency, failed):
+        self.limit.release(latency, failed)
+        # The limit may have grown, so all waiting requests check again
+        async with self.slots:
+            self.slots.notify_all()
+
+    async def fetch_match(self, match_id, etags=None):
+        # With an etags dict the stored ETag of the match is sent as If-None-Match and the new ETag is stored
+        url = f"{self.base_url}{MATCH_ENDPOINT.format(match_id=match_id)}"
+        renewed_token = False
+        attempt = 1
+        while True:
+            headers = await self.get_headers()
+            if etags is not None and etags.get(match_id):
+                headers["If-None-Match"] = etags[match_id]
+            await self.breaker.wait_async()
+            retry_after = None
+            await self.acquire_slot()
+            failed = True
+            start = time.perf_counter()
+            try:
+                await self.get_rate_limiter(url).wait()
+                start = time.perf_counter()
+                with metrics.timer("api_fetch"):
+                    async with self.session.get(url, headers=headers) as response:
+                        status = response.status
+                        if status not in RETRY_STATUSES:
+                            self.breaker.record_success()
+                            failed = False
+                            if status == 304 and "If-None-Match" in headers:
+                                metrics.count("api_not_modified")
+                                return NOT_MODIFIED
+                            if status == 401 and not renewed_token and isinstance(self.token, TokenProvider):
+                                self.token.invalidate()
+                                renewed_token = True
+                                continue
+                            if status != 200 or response.headers.get('content-type', '').lower() != 'application/json; charset=utf-8':
+                                print(f"Error getting data from API for match {match_id}. Status code: {status}")
+                                metrics.count("api_errors")
+                                return None
+                            if etags is not None:
+                                etags[match_id] = response.headers.get('ETag')
+                            return await response.json()
+                        self.breaker.record_failure()
+                        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                        error = f"status code {status}"
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.breaker.record_failure()
+                if attempt == self.retry_policy.max_attempts:
+                    raise
+                error = repr(e)
+            finally:
+                await self.release_slot(time.perf_counter() - start, failed)
+
+            if attempt == self.retry_policy.max_attempts:
+                print(f"Error getting data from API for match {match_id}: {error}")
+                metrics.count("api_errors")
+                return None
+            # Waiting happens outside the slot, so other matches can use the slot
+            metrics.count("retries")
+            await asyncio.sleep(self.retry_policy.get_delay(attempt, retry_after))
+            attempt += 1
+
+    async def fetch_matches(self, match_ids, etags=None):
+        # Returns {match_id: api_data}, api_data is None when the match could not be fetched
+        # and NOT_MODIFIED when etags was passed and the match did not change
+        match_ids = list(match_ids)
+        if isinstance(self.token, TokenProvider):
+            # Without a token every request of the chunk would fail, one token request is enough to know
+            try:
+                await self.token.get_token_async()
+            except TokenError as e:
+                print(f"Skipping {len(match_ids)} matches, {e}")
+                metrics.count("api_errors", len(match_ids))
+                return {match_id: None for match_id in match_ids}
+        results = await asyncio.gather(*(self.fetch_match(match_id, etags) for match_id in match_ids),
+                                       return_exceptions=True)
+        api_data = {}
+        for match_id, result in zip(match_ids, results):
+            if isinstance(result, Exception):
+                print(f"Error getting data from API for match {match_id}: {result!r}")
+                metrics.count("api_errors")
+                result = None
+            api_data[match_id] = result
+        return api_data
+
+
+async def fetch_matches_async(base_url, token, match_ids, concurrency=10, rate_per_host=None, etags=None, limit=None):
+    async with AsyncMatchFetcher(base_url, token, concurrency, rate_per_host, limit=limit) as fetcher:
+        return await fetcher.fetch_matches(match_ids, etags)
+
+
+def fetch_matches(base_url, token, match_ids, concurrency=10, rate_per_host=None, etags=None, limit=None):
+    # Blocking wrapper for callers that are not async themselves
+    return asyncio.run(fetch_matches_async(base_url, token, match_ids, concurrency, rate_per_host, etags, limit))
@@ -0,0 +1,200 @@
+import datetime
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+
+from compare_match import mappings, get_api_match_and_players, get_token, read_db_data, \
+    compare_match_frames
+from api_fetcher import fetch_matches
+from db_pool import ConnectionPool
+from db_reader import frame_reader
+from query_builder import COLUMN_TYPES
+from result_sink import CsvSink
+from stub_server import StubApiServer
+from token_provider import TokenProvider, set_token_provider
+import metrics
+
+# Benchmark of the comparison path with local stand-ins: synthetic matches in a SQLite file with the tables
+# of the SQL Server schema, and a local HTTP server for the identity server and the matches endpoint.
+# Run from the src folder: python benchmark.py
+
+ENVIRONMENT = "test"
+
+POSITIONS = ["GK", "DF", "MF", "FW"]
+
+SCHEMA = [
+    "CREATE TABLE SEASONS (SEASON_ID INTEGER PRIMARY KEY, NAME TEXT, START_DATE TEXT, END_DATE TEXT)",
+    "CREATE TABLE LEAGUES (LEAGUE_ID INTEGER PRIMARY KEY, NAME TEXT, GENDER INTEGER, AREA_ID INTEGER)",
+    "CREATE TABLE TEAMS (TEAM_ID INTEGER PRIMARY KEY, NAME TEXT)",
+    """CREATE TABLE MATCHES (MATCH_ID INTEGER PRIMARY KEY, SEASON_ID INTEGER, LEAGUE_ID INTEGER,
+        HOME_TEAM_ID INTEGER, AWAY_TEAM_ID INTEGER, KICKOFF_DATE TEXT)""",
+    """CREATE TABLE MATCH_TEAM_PLAYERS (MATCH_ID INTEGER, TEAM_ID INTEGER, PLAYER_ID INTEGER, SHIRT_NUMBER INTEGER,
+        MINUTES_PLAYED INTEGER, STARTING INTEGER, POSITION_1 TEXT, GOALS INTEGER, YELLOW_CARDS INTEGER)""",
+    "CREATE INDEX MATCH_TEAM_PLAYERS_MATCH_ID ON MATCH_TEAM_PLAYERS (MATCH_ID)",
+]
+
+
+def maybe_change(rng, mismatch_rate, value, changed_value):
+    # The API gets a different value than the DB for about mismatch_rate of the fields
+    return changed_value if rng.random() < mismatch_rate else value
+
+
+def generate_matches(match_count, players_per_team=18, mismatch_rate=0.05, seed=0, first_match_id=1):
+    # Returns (tables, api_data): the rows per DB table and the API payload per match id
+    rng = random.Random(seed)
+    seasons = [(1, "2023/2024", "2023-07-01 00:00:00", "2024-06-30 00:00:00")]
+    leagues = [(league_id, f"League {league_id}", 1 if league_id % 2 else 2, 2000 + league_id)
+               for league_id in range(1, 6)]
+    teams = [(team_id, f"Team {team_id}") for team_id in range(1, 41)]
+    tables = {"SEASONS": seasons, "LEAGUES": leagues, "TEAMS": teams, "MATCHES": [], "MATCH_TEAM_PLAYERS": []}
+    api_data = {}
+    season_id, season_name, start_date, end_date = seasons[0]
+    kickoff_start = datetime.datetime(2023, 8, 1, 15)
+
+    for match_id in range(first_match_id, first_match_id + match_count):
+        league_id, league_name, gender, area_id = rng.choice(leagues)
+        (home_team_id, home_name), (away_team_id, away_name) = rng.sample(teams, 2)
+        kickoff = kickoff_start + datetime.timedelta(hours=rng.randrange(24 * 300))
+        tables["MATCHES"].append((match_id, season_id, league_id, home_team_id, away_team_id,
+                                  kickoff.strftime("%Y-%m-%d %H:%M:%S")))
+
+        api_teams = {}
+        for team_type, team_id, team_name in (("homeTeam", home_team_id, home_name),
+                                              ("awayTeam", away_team_id, away_name)):
+            api_players = []
+            for shirt_number in range(1, players_per_team + 1):
+                player_id = team_id * 1000 + shirt_number
+                starting = shirt_number <= 11
+                minutes = rng.choice([90, 90, 90, 75, 60, 45, 20]) if starting else rng.choice([0, 0, 15, 30])
+                position = POSITIONS[min(shirt_number // 4, 3)]
+                tables["MATCH_TEAM_PLAYERS"].append((match_id, team_id, player_id, shirt_number, minutes,
+                                                     int(starting), position, 0, 0))
+                api_players.append({
+                    "sourceReferences": [{"sourceValue": str(player_id)}],
+                    "shirtNumber": shirt_number,
+                    "minutesPlayed": maybe_change(rng, mismatch_rate, minutes, minutes + 1),
+                    "starting": maybe_change(rng, mismatch_rate, starting, not starting),
+                    "position": maybe_change(rng, mismatch_rate, position, "SUB"),
+                })
+            api_teams[team_type] = {
+                "sourceReferences": [{"sourceValue": str(team_id)}],
+                "name": maybe_change(rng, mismatch_rate, team_name, team_name + " FC"),
+                "players": api_players,
+            }
+
+        api_data[match_id] = {
+            "season": {"startDate": start_date.replace(" ", "T"), "endDate": end_date.replace(" ", "T"),
+                       "name": season_name},
+            "league": {"gender": "Male" if gender == 1 else "Female", "nation": area_id,
+                       "name": maybe_change(rng, mismatch_rate, league_name, league_name.upper())},
+            "kickOffDate": maybe_change(rng, mismatch_rate, kickoff.strftime("%Y-%m-%dT%H:%M:%S"),
+                                        (kickoff + datetime.timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%S")),
+            "homeTeam": api_teams["homeTeam"],
+            "awayTeam": api_teams["awayTeam"],
+        }
+    return tables, api_data
+
+
+def create_sqlite_db(path, tables):
+    # SQLite stand-in for the SQL Server tables the queries of query_builder use
+    with sqlite3.connect(path) as conn:
+        for statement in SCHEMA:
+            conn.execute(statement)
+        for table, rows in tables.items():
+            if rows:
+                conn.executemany(f"INSERT INTO {table} VALUES ({','.join('?' * len(rows[0]))})", rows)
+    conn.close()
+
+
+class StageTimer:
+    # Collects the duration of every call per stage
+    def __init__(self):
+        self.durations = {}
+
+    def time(self, stage, function, *args, **kwargs):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        self.durations.setdefault(stage, []).append(time.perf_counter() - start)
+        return result
+
+    def report(self, metric_stages=()):
+        # metric_stages are stages timed with metrics.timer inside the stages, e.g. "normalise" in compare_frames
+        print(f"{'Stage':<28}{'Total s':>10}{'Mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+        for stage, durations in self.durations.items():
+            durations = np.array(durations)
+            print(f"{stage:<28}{durations.sum():>10.3f}{durations.mean() * 1000:>10.2f}"
+                  f"{np.percentile(durations, 50) * 1000:>10.2f}{np.percentile(durations, 95) * 1000:>10.2f}")
+        for row in metrics.summarize():
+            if row["type"] == "timer" and row["stage"] in metric_stages:
+                print(f"{'  ' + row['stage']:<28}{row['sum']:>10.3f}{row['sum'] / row['count'] * 1000:>10.2f}"
+                      f"{row['p50'] * 1000:>10.2f}{row['p95'] * 1000:>10.2f}")
+
+
+def run_benchmark(match_count=200, players_per_team=18, mismatch_rate=0.05, api_latency=0.0, concurrency=10,
+                  seed=0):
+    # Runs every match through the stages of compare_match one after the other and times them,
+    # then fetches all matches again with the async fetcher of the batch runs
+    tables, api_data = generate_matches(match_count, players_per_team, mismatch_rate, seed)
+    match_ids = list(api_data)
+    timer = StageTimer()
+    # The normalisers are timed inside compare_frames
+    metrics_enabled = metrics.enabled
+    metrics.enable(ENVIRONMENT)
+    metrics.reset()
+    token_provider = None
+
+    try:
+        with tempfile.TemporaryDirectory() as directory, StubApiServer(api_data, api_latency) as server:
+            db_path = os.path.join(directory, "benchmark.sqlite")
+            create_sqlite_db(db_path, tables)
+            credentials_file = os.path.join(directory, "api_credentials.json")
+            with open(credentials_file, "w") as f:
+                json.dump({"grant_type": "password", "client_id": "benchmark"}, f)
+            token_provider = TokenProvider(credentials_file, f"{server.base_url}/connect/token")
+            # The stub is gone after the benchmark, the provider of the environment is put back in finally
+            previous_provider = set_token_provider(ENVIRONMENT, token_provider)
+            config = {"api": {"base_url": server.base_url}}
+            pool = ConnectionPool(lambda: sqlite3.connect(db_path, check_same_thread=False))
+            reader = frame_reader(COLUMN_TYPES)
+            sink = CsvSink(os.path.join(directory, "benchmark.csv"))
+
+            mismatches = 0
+            start = time.perf_counter()
+            for match_id in match_ids:
+                timer.time("token", get_token, ENVIRONMENT)
+                api_match = timer.time("api fetch", get_api_match_and_players, ENVIRONMENT, config, match_id)
+                db_data, db_players = timer.time("db fetch", read_db_data, pool, reader, match_id)
+                comparison_df = timer.time("compare (incl. normalise)", compare_match_frames, match_id, api_match,
+                                           db_data, db_players, [])
+                timer.time("write", sink.write, match_id, comparison_df)
+                mismatches += int((~comparison_df['Match']).sum())
+            elapsed = time.perf_counter() - start
+            sink.close()
+
+            start = time.perf_counter()
+            fetched = timer.time("api fetch async (all)", fetch_matches, server.base_url, token_provider, match_ids,
+                                 concurrency)
+            async_elapsed = time.perf_counter() - start
+            pool.close()
+
+        print(f"{match_count} matches, {players_per_team} players per team, {len(mappings)} match mappings, "
+              f"mismatch rate {mismatch_rate}, API latency {api_latency * 1000:.0f} ms")
+        timer.report(metric_stages=("normalise",))
+    finally:
+        if token_provider is not None:
+            set_token_provider(ENVIRONMENT, previous_provider)
+        metrics.reset()
+        if not metrics_enabled:
+            metrics.disable()
+    print(f"Sequential: {elapsed:.2f} s, {match_count / elapsed:.1f} matches/sec, {mismatches} mismatches")
+    print(f"Async API fetch: {async_elapsed:.2f} s, {len([data for data in fetched.values() if data]) / async_elapsed:.1f} "
+          f"matches/sec with concurrency {concurrency}")
+
+
+if __name__ == "__main__":
+    run_benchmark(match_count=200, players_per_team=18, mismatch_rate=0.05, api_latency=0.0)
@@ -0,0 +1,281 @@
+import json
+from contextlib import nullcontext
+
+from compare_match import mappings, player_mappings, player_key, get_config_files, get_db_config, get_db_pool, \
+    get_db_reader, split_db_data, compare_match_chunk
+from compare_engine import PLAYER_KEYS
+from query_builder import build_match_query, build_player_query, build_checksum_query, COLUMN_TYPES, MATCH_JOINS
+from api_fetcher import fetch_matches, NOT_MODIFIED
+from adaptive_limit import AdaptiveLimit
+from token_provider import get_token_provider
+from state_store import StateStore, hash_api_data, hash_db_data
+from result_sink import open_sink
+from response_cache import fetch_with_cache
+from db_snapshot import Snapshot, SnapshotWriter
+import metrics
+
+
+# Batch queries, the match ids of a chunk are loaded in a temp table and joined instead of one query per match
+MATCH_IDS_JOIN = "JOIN #MATCH_IDS IDS ON M.MATCH_ID = IDS.MATCH_ID"
+BATCH_MATCH_QUERY = build_match_query(mappings, MATCH_IDS_JOIN)
+BATCH_PLAYER_QUERY = build_player_query(player_mappings, PLAYER_KEYS[player_key], MATCH_IDS_JOIN)
+
+# Cheap check whether the rows of a match changed, without fetching them
+CHECKSUM_QUERY = build_checksum_query("#MATCH_IDS")
+# Parts of the checksum, stored with snapshots so snapshots with checksums of an older query are recognised
+CHECKSUM_COLUMNS = ["MATCH"] + list(MATCH_JOINS) + ["PLAYERS"]
+
+
+def chunk_match_ids(match_ids, chunk_size):
+    chunk = []
+    for match_id in match_ids:
+        chunk.append(match_id)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def create_match_ids_table(pooled):
+    cursor = pooled.conn.cursor()
+    # The temp table lives as long as the pooled connection, so it can already exist
+    cursor.execute("IF OBJECT_ID('tempdb..#MATCH_IDS') IS NULL CREATE TABLE #MATCH_IDS (MATCH_ID INT PRIMARY KEY)")
+    cursor.fast_executemany = True
+    return cursor
+
+
+def load_match_ids(cursor, match_ids):
+    # Duplicate ids would break the primary key
+    match_ids = list(dict.fromkeys(int(match_id) for match_id in match_ids))
+    cursor.execute("TRUNCATE TABLE #MATCH_IDS")
+    if match_ids:
+        cursor.executemany("INSERT INTO #MATCH_IDS (MATCH_ID) VALUES (?)", [(match_id,) for match_id in match_ids])
+    return match_ids
+
+
+def get_loaded_db_data(pooled, match_ids, reader):
+    # Returns [(match_id, db_data, db_players)] for the match ids loaded in #MATCH_IDS, the same as
+    # get_db_data returns for a single match. db_data is None for matches that are not in the DB.
+    match_df, players_df = get_loaded_db_frames(pooled, reader)
+    db_data = split_db_data(match_df, players_df)
+    return [(match_id,) + db_data.get(match_id, (None, players_df.iloc[0:0])) for match_id in match_ids]
+
+
+def get_loaded_db_frames(pooled, reader):
+    # Returns (match_df, players_df) with the rows of all matches loaded in #MATCH_IDS
+    with metrics.timer("db_fetch_chunk"):
+        return pooled.read_query(BATCH_MATCH_QUERY, reader=reader), pooled.read_query(BATCH_PLAYER_QUERY, reader=reader)
+
+
+def get_loaded_db_checksums(pooled):
+    # Returns {match_id: checksum} for the match ids loaded in #MATCH_IDS
+    with metrics.timer("db_checksum"):
+        columns, rows = pooled.read_query(CHECKSUM_QUERY)
+    return {int(row[0]): ":".join(str(value) for value in row[1:]) for row in rows}
+
+
+def get_db_data_chunks(config, match_ids, chunk_size=1000):
+    # Yields one list of (match_id, db_data, db_players) per chunk of match ids, one query per chunk and side
+    reader = get_db_reader(config)
+    with get_db_pool(config).connection() as pooled:
+        cursor = create_match_ids_table(pooled)
+        for chunk in chunk_match_ids(match_ids, chunk_size):
+            chunk = load_match_ids(cursor, chunk)
+            yield get_loaded_db_data(pooled, chunk, reader)
+        cursor.close()
+
+
+def get_db_data_batch(config, match_ids, chunk_size=1000):
+    # Yields (match_id, db_data, db_players) for every requested match
+    for chunk in get_db_data_chunks(config, match_ids, chunk_size):
+        yield from chunk
+
+
+def create_db_snapshot(environment, match_ids, snapshot_path, chunk_size=1000):
+    # Writes the DB side of match_ids to a local snapshot (see db_snapshot), batch runs with snapshot_path read it
+    # instead of querying the DB. A snapshot that already exists at snapshot_path is only replaced on success.
+    _, db_config_file = get_config_files(environment)
+    config = get_db_config(db_config_file)
+    reader = get_db_reader(config)
+    with get_db_pool(config).connection() as pooled, \
+            SnapshotWriter(snapshot_path, environment, COLUMN_TYPES, CHECKSUM_COLUMNS) as writer:
+        cursor = create_match_ids_table(pooled)
+        for chunk in chunk_match_ids(match_ids, chunk_size):
+            load_match_ids(cursor, chunk)
+            writer.write(*get_loaded_db_frames(pooled, reader), get_loaded_db_checksums(pooled))
+        cursor.close()
+    print(f"Snapshot of {writer.match_count} matches written to {snapshot_path}.")
+
+
+def get_snapshot_db_data_chunks(config, snapshot, match_ids, chunk_size=1000, check_freshness=True):
+    # Like get_db_data_chunks, but the DB side comes from a Snapshot. With check_freshness the DB checksums are
+    # compared with the ones in the snapshot first, matches that changed or are missing are read from the DB.
+    # Without it the DB is not used at all.
+    reader = get_db_reader(config)
+    with get_db_pool(config).connection() if check_freshness else nullcontext() as pooled:
+        cursor = create_match_ids_table(pooled) if check_freshness else None
+        for chunk in chunk_match_ids(match_ids, chunk_size):
+            chunk = list(dict.fromkeys(int(match_id) for match_id in chunk))
+            stale = []
+            if check_freshness:
+                load_match_ids(cursor, chunk)
+                checksums = get_loaded_db_checksums(pooled)
+                stale = [match_id for match_id in chunk
+                         if match_id not in snapshot.checksums or snapshot.checksums[match_id] != checksums.get(match_id)]
+            stale_ids = set(stale)
+
+            db_data = split_db_data(*snapshot.get_frames([match_id for match_id in chunk if match_id not in stale_ids]))
+            if stale:
+                print(f"{len(stale)} of {len(chunk)} matches changed since the snapshot, reading them from the DB.")
+                load_match_ids(cursor, stale)
+                db_data.update(split_db_data(*get_loaded_db_frames(pooled, reader)))
+            yield [(match_id,) + db_data.get(match_id, (None, None)) for match_id in chunk]
+        if cursor is not None:
+            cursor.close()
+
+
+def get_changed_db_data_chunks(config, environment, match_ids, chunk_size, state_store, fetch_api):
+    # Like get_db_data_chunks, but only yields the matches whose DB checksum or API payload changed since the
+    # state in state_store. fetch_api(match_ids, etags) returns the API data of a chunk, it is called before
+    # the DB rows are fetched so unchanged matches are never read. Yields (chunk, api_chunk, etags, checksums).
+    reader = get_db_reader(config)
+    with get_db_pool(config).connection() as pooled:
+        cursor = create_match_ids_table(pooled)
+        for chunk in chunk_match_ids(match_ids, chunk_size):
+            chunk = load_match_ids(cursor, chunk)
+            states = state_store.get_states(environment, chunk)
+            checksums = get_loaded_db_checksums(pooled)
+
+            # Conditional API requests for the matches whose DB side did not change, etags gets the new ETags
+            unchanged_db = {match_id for match_id in chunk
+                            if match_id in states and states[match_id]["DB_CHECKSUM"] == checksums.get(match_id)}
+            etags = {match_id: states[match_id]["API_ETAG"] for match_id in unchanged_db}
+            api_chunk = fetch_api(chunk, etags)
+
+            changed = []
+            for match_id in chunk:
+                api_data = api_chunk.get(match_id)
+                if match_id in unchanged_db and (api_data == NOT_MODIFIED or (
+                        api_data is not None and hash_api_data(api_data) == states[match_id]["API_HASH"])):
+                    continue
+                changed.append(match_id)
+
+            print(f"{len(chunk) - len(changed)} of {len(chunk)} matches unchanged since the last run.")
+            metrics.count("matches_unchanged", len(chunk) - len(changed))
+            if changed:
+                load_match_ids(cursor, changed)
+                yield get_loaded_db_data(pooled, changed, reader), api_chunk, etags, checksums
+        cursor.close()
+
+
+def compare_match_batch(environment, match_ids, csv_filename, chunk_size=1000, concurrency=10, rate_per_host=None,
+                        state_file=None, output_file=None, output_header=True, summary_file=None,
+                        mismatches_only=False, cache=None, snapshot_path=None, check_snapshot=True, journal=None,
+                        max_concurrency=50):
+    # Compare a list or range of match ids, the DB side is fetched with set based queries per chunk
+    # and the API side concurrently per chunk.
+    # The API requests in flight start at concurrency and adapt to the latency and errors of the API, up to
+    # max_concurrency, over all chunks of the batch. max_concurrency=None keeps them at concurrency.
+    # csv_filename is the prefix, the match id and .csv are added per match.
+    # With an output_file the results of all matches go to that one file or dataset instead (see result_sink).
+    # mismatches_only keeps only the mismatching fields, summary_file adds counts per match and per mapping.
+    # With a state_file only matches whose DB or API data changed since the last run are compared again.
+    # cache is an optional ResponseCache, API responses it has are not fetched again.
+    # With a snapshot_path (see create_db_snapshot) the DB side is read from the snapshot, check_snapshot reads
+    # the matches that changed since the snapshot from the DB. The snapshot is not used together with a state_file.
+    # With a journal (see job_runner) the outcome of the matches of every chunk is recorded once their results
+    # are written.
+    metrics.set_environment(environment)
+    api_config_file, db_config_file = get_config_files(environment)
+
+    with open(api_config_file) as f:
+        config = json.load(f)
+    db_config = get_db_config(db_config_file)
+
+    token_provider = get_token_provider(environment)
+    api_limit = AdaptiveLimit("api", concurrency, 1, max_concurrency) if max_concurrency else None
+
+    def fetch_live(api_match_ids, etags=None):
+        return fetch_matches(config['api']['base_url'], token_provider, api_match_ids, concurrency, rate_per_host,
+                             etags, api_limit)
+
+    def fetch_api(api_match_ids, etags=None):
+        with metrics.timer("api_fetch_chunk"):
+            return fetch_with_cache(cache, environment, api_match_ids, fetch_live, etags)
+
+    if state_file is None:
+        state_store = None
+        if snapshot_path is None:
+            db_chunks = get_db_data_chunks(db_config, match_ids, chunk_size)
+        else:
+            snapshot = Snapshot(snapshot_path)
+            if snapshot.info["environment"] != environment:
+                raise ValueError(f"Snapshot {snapshot_path} is of environment {snapshot.info['environment']}, "
+                                 f"not {environment}")
+            if snapshot.info.get("checksum_columns") != CHECKSUM_COLUMNS:
+                # Its checksums miss the season, league and team rows: with check_snapshot every match is read
+                # from the DB again, without it changes of those rows are not seen
+                print(f"Snapshot {snapshot_path} was written with an older DB checksum, create it again "
+                      f"(create_db_snapshot) to use it.")
+            db_chunks = get_snapshot_db_data_chunks(db_config, snapshot, match_ids, chunk_size, check_snapshot)
+        chunks = ((chunk, fetch_api([match_id for match_id, db_data, _ in chunk if db_data is not None]), {}, {})
+                  for chunk in db_chunks)
+    else:
+        state_store = StateStore(state_file)
+        chunks = get_changed_db_data_chunks(db_config, environment, match_ids, chunk_size, state_store, fetch_api)
+
+    failed_match_ids = []
+    sink = open_sink(output_file, csv_filename, output_header, environment, summary_file, mismatches_only)
+    if journal is not None:
+        # From here on only the rows of journaled chunks are kept, also when the run stops in the middle of a chunk
+        sink.checkpoint()
+    try:
+        for chunk, api_chunk, etags, checksums in chunks:
+            chunk_done, chunk_failed = [], {}
+            compared = []
+            for match_id, db_data, db_players in chunk:
+                if db_data is None:
+                    print(f"No DB rows found for match {match_id}.")
+                    failed_match_ids.append(match_id)
+                    chunk_failed[match_id] = "no_db_rows"
+                    metrics.count("matches_failed")
+                    continue
+
+                api_data = api_chunk.get(match_id)
+                if api_data is None or api_data == NOT_MODIFIED:
+                    print(f"No API data found for match {match_id}.")
+                    failed_match_ids.append(match_id)
+                    chunk_failed[match_id] = "no_api_data"
+                    metrics.count("matches_failed")
+                    continue
+                compared.append((match_id, api_data, db_data, db_players))
+
+            # The normalisers run once per chunk, not once per match
+            comparison_dfs = compare_match_chunk(compared)
+            for (match_id, api_data, db_data, db_players), comparison_df in zip(compared, comparison_dfs):
+                if state_store is not None:
+                    db_hash = hash_db_data(db_data, db_players)
+                league = db_data["LEAGUE_ID"]
+                with metrics.timer("write"):
+                    sink.write(match_id, comparison_df, league)
+                mismatches = int((~comparison_df['Match']).sum())
+                chunk_done.append(match_id)
+                metrics.count("matches_compared")
+                metrics.count("mismatches", mismatches)
+
+                if state_store is not None:
+                    state_store.save_state(environment, match_id, checksums.get(match_id), db_hash,
+                                           etags.get(match_id), hash_api_data(api_data), len(comparison_df),
+                                           mismatches)
+            if state_store is not None:
+                state_store.commit()
+            if journal is not None:
+                sink.checkpoint()
+                journal.record(chunk_done, chunk_failed)
+    finally:
+        sink.close()
+        if state_store is not None:
+            state_store.close()
+
+    return failed_match_ids
@@ -0,0 +1,184 @@
+import numbers
+
+import numpy as np
+import pandas as pd
+
+from mapping_paths import compile_path, compile_mappings
+from normalizers import normalize_columns
+import metrics
+
+
+COMPARISON_COLUMNS = ['DB Column Name', 'API Name', 'DB Value', 'API Value', 'Match']
+
+# API team key and the IS_HOME value of its DB rows
+TEAM_TYPES = [("homeTeam", 1), ("awayTeam", 0)]
+
+# (DB column, API path) pairs used to pair DB players with API players
+PLAYER_KEYS = {
+    "shirt_number": [("SHIRT_NUMBER", "shirtNumber")],
+    "player_id": [("PLAYER_ID", "sourceReferences[0].sourceValue")],
+    "composite": [("PLAYER_ID", "sourceReferences[0].sourceValue"), ("SHIRT_NUMBER", "shirtNumber")],
+}
+
+
+def compare_values(value1, value2):
+    if isinstance(value1, (int, float)) and isinstance(value2, (int, float)):
+        return float(value1) == float(value2)
+    else:
+        return str(value1) == str(value2)
+
+
+def get_nested_value(data, key_path):
+    # The path is only parsed the first time it is used
+    return compile_path(key_path).get(data)
+
+
+def to_object_array(values):
+    return pd.Series(values, dtype=object).to_numpy()
+
+
+def is_number(values):
+    return np.fromiter((isinstance(value, numbers.Real) for value in values), dtype=bool, count=len(values))
+
+
+def compare_columns(db_values, api_values):
+    # Vectorised compare_values: numbers are compared as floats, everything else as strings
+    db_values = to_object_array(db_values)
+    api_values = to_object_array(api_values)
+    numeric = is_number(db_values) & is_number(api_values)
+    match = np.zeros(len(db_values), dtype=bool)
+    if numeric.any():
+        match[numeric] = db_values[numeric].astype(float) == api_values[numeric].astype(float)
+    if not numeric.all():
+        text = ~numeric
+        match[text] = db_values[text].astype(str) == api_values[text].astype(str)
+    return match
+
+
+def flatten_api_players(api_data, player_mappings, key_columns):
+    # One row per API player with an IS_HOME column and one column per mapped or key API path
+    paths = list(dict.fromkeys([path for _, path in key_columns] + [api_name for _, api_name in player_mappings]))
+    columns = {path: [] for path in paths}
+    is_home = []
+    for team_type, team_is_home in TEAM_TYPES:
+        is_home.extend([team_is_home] * len(compile_path(f"{team_type}.players").get(api_data)))
+        for path in paths:
+            # Whole column at once, players without the path get None
+            columns[path].extend(compile_path(f"{team_type}.players[*].{path}").get(api_data, None))
+
+    api_players = pd.DataFrame({path: to_object_array(values) for path, values in columns.items()})
+    api_players['IS_HOME'] = np.array(is_home, dtype=int)
+    return api_players
+
+
+def normalize_key(values):
+    # Numbers become floats so 7, 7.0 and "7" are the same key, anything else is compared as string
+    values = pd.Series(values, dtype=object).reset_index(drop=True)
+    numbers = pd.to_numeric(values, errors='coerce')
+    return numbers.astype(object).where(numbers.notna(), values.where(values.isna(), values.astype(str)))
+
+
+def get_player_keys(key_parts):
+    # One hashable key per player, None when a part of the key is missing
+    parts = [normalize_key(values) for values in key_parts]
+    missing = np.zeros(len(parts[0]), dtype=bool)
+    for part in parts:
+        missing |= part.isna().to_numpy()
+    return [None if is_missing else key for key, is_missing in zip(zip(*parts), missing)]
+
+
+def match_team_players(db_team, api_team, key_columns):
+    # Returns (positions, api_matched): the position in api_team of the API player of every DB player
+    # (-1 when there is none) and a mask of the API players that were paired with a DB player
+    db_keys = get_player_keys([db_team[db_column] for db_column, _ in key_columns])
+    api_keys = get_player_keys([api_team[path] for _, path in key_columns])
+
+    # The first API player with a key wins, like the linear scan did
+    api_index = {}
+    for position, key in enumerate(api_keys):
+        if key is not None and key not in api_index:
+            api_index[key] = position
+
+    positions = np.array([-1 if key is None else api_index.get(key, -1) for key in db_keys], dtype=int)
+    api_matched = np.zeros(len(api_team), dtype=bool)
+    api_matched[positions[positions >= 0]] = True
+    return positions, api_matched
+
+
+def format_player_keys(frame, columns):
+    return ["/".join(str(value) for value in values) for values in zip(*(frame[column] for column in columns))]
+
+
+def compare_frames(match_id, api_data, db_data, db_players, mappings, player_mappings, player_key="shirt_number",
+                   unmatched_players=None, normalizers=None):
+    # Compare the DB side of one match with its API payload, returns the comparison frame.
+    # normalizers ({DB column: normaliser name}, see normalizers.py) are applied to the values before comparing.
+    return build_comparison_frame(*collect_values(match_id, api_data, db_data, db_players, mappings, player_mappings,
+                                                  player_key, unmatched_players), normalizers)
+
+
+def collect_values(match_id, api_data, db_data, db_players, mappings, player_mappings, player_key="shirt_number",
+                   unmatched_players=None):
+    # The values of one match to compare, not normalised yet: (db_names, api_names, db_values, api_values).
+    # db_data holds the match level DB values by column, db_players has one row per player (index starting at 0).
+    # Players are paired on PLAYER_KEYS[player_key]. Players without a partner on the other side are printed
+    # in one line, or added as dicts to unmatched_players when a list is passed.
+    db_names, api_names, db_values, api_values = [], [], [], []
+
+    # Match data, one value per mapping
+    db_names.append(np.array([db_column_name for db_column_name, _ in mappings], dtype=object))
+    api_names.append(np.array([api_name for _, api_name in mappings], dtype=object))
+    db_values.append(to_object_array([db_data[db_column_name] for db_column_name, _ in mappings]))
+    api_values.append(to_object_array([path.get(api_data) for _, _, path in compile_mappings(mappings)]))
+
+    # Player data, one value per mapping per matched player
+    player_db_columns = [db_column_name for db_column_name, _ in player_mappings]
+    player_api_names = np.array([api_name for _, api_name in player_mappings], dtype=str)
+    key_columns = PLAYER_KEYS[player_key]
+    api_players = flatten_api_players(api_data, player_mappings, key_columns)
+    unmatched = []
+
+    for team_type, is_home in TEAM_TYPES:
+        db_team = db_players[db_players['IS_HOME'] == is_home]
+        api_team = api_players[api_players['IS_HOME'] == is_home].reset_index(drop=True)
+        positions, api_matched = match_team_players(db_team, api_team, key_columns)
+
+        for key in format_player_keys(db_team[positions < 0], [db_column for db_column, _ in key_columns]):
+            unmatched.append({'Match ID': match_id, 'Team': team_type, 'Source': 'DB', 'Key': key})
+        for key in format_player_keys(api_team[~api_matched], [path for _, path in key_columns]):
+            unmatched.append({'Match ID': match_id, 'Team': team_type, 'Source': 'API', 'Key': key})
+
+        db_matched = db_team[positions >= 0]
+        api_paired = api_team.iloc[positions[positions >= 0]]
+        count = len(db_matched)
+
+        prefixes = np.array([f"{team_type}.players[{i}]." for i in db_matched.index], dtype=str)
+        db_names.append(np.tile(np.array(player_db_columns, dtype=object), count))
+        api_names.append(np.char.add(np.repeat(prefixes, len(player_api_names)),
+                                     np.tile(player_api_names, count)).astype(object))
+        db_values.append(np.column_stack([db_matched[column].to_numpy(dtype=object)
+                                          for column in player_db_columns]).ravel() if count else np.empty(0, dtype=object))
+        api_values.append(np.column_stack([api_paired[api_name].to_numpy(dtype=object)
+                                           for _, api_name in player_mappings]).ravel() if count else np.empty(0, dtype=object))
+
+    if unmatched_players is not None:
+        unmatched_players.extend(unmatched)
+    elif unmatched:
+        print(f"Unmatched players of match {match_id} on {player_key}: "
+              + ", ".join(f"{player['Source']} {player['Team']} {player['Key']}" for player in unmatched))
+
+    return (np.concatenate(db_names), np.concatenate(api_names), np.concatenate(db_values),
+            np.concatenate(api_values))
+
+
+def build_comparison_frame(db_names, api_names, db_values, api_values, normalizers=None):
+    # Normalises and compares the values of collect_values, of one match or of many matches concatenated
+    with metrics.timer("normalise"):
+        db_values, api_values = normalize_columns(db_names, db_values, api_values, normalizers or {})
+    return pd.DataFrame({
+        'DB Column Name': db_names,
+        'API Name': api_names,
+        'DB Value': db_values,
+        'API Value': api_values,
+        'Match': compare_columns(db_values, api_values),
+    }, columns=COMPARISON_COLUMNS)
@@ -1,77 +1,61 @@
 # compare_match_data.py
-import pandas as pd
-import pyodbc
 import json
 import requests
 from urllib.parse import urlencode
 
-
-# AccessToken class and related functions
-class AccessToken:
-    access_token = ""
-
-    def __init__(self, properties_file_path, token_url):
-        with open(properties_file_path) as f:
-            prop = json.load(f)
-        grant_type = prop.get("grant_type")
-        username = prop.get("username")
-        password = prop.get("password")
-        client_id = prop.get("client_id")
-        client_secret = prop.get("client_secret")
-        scope = prop.get("scope")
-
-        # send the request
-        url = token_url
-        data = {
-            "grant_type": grant_type,
-            "username": username,
-            "password": password,
-            "client_id": client_id,
-            "client_secret": client_secret,
-            "scope": scope
-        }
-        headers = {"Content-Type": "application/x-www-form-urlencoded"}
-        response = requests.post(url, data=data, headers=headers)
-        response.raise_for_status()
-        json_data = json.loads(response.text)
-        AccessToken.access_token = json_data["access_token"]
-
-        # Save the access token to a variable and print it
-        self.saved_access_token = AccessToken.access_token
-        print("Access token:", self.saved_access_token)
-        response.close()
-
-    def get_access_token(self):
-        return self.saved_access_token
+from token_provider import get_token_provider
+from resilience import request_with_retry, get_breaker, CONNECT_TIMEOUT, READ_TIMEOUT
+from compare_engine import compare_frames
+from compare_match import normalizers, get_db_pool, get_db_reader
+from query_builder import build_match_query, build_player_query
 
 
 def get_token(config):
-    access_token = AccessToken("../properties/api_credentials.json", "https://identity-test.scisports.app/connect/token")
-    token = access_token.get_access_token()
+    try:
+        token = get_token_provider('test').get_token()
+    except requests.RequestException as e:
+        print(f"Error getting access token: {e}")
+        return None
     if token is None:
         print("Error getting access token")
         return None
     return token
 
-def get_api_match_and_players(config, match_id):
+def get_api_headers(config):
     token = get_token(config)
     if token is None:
-        return
-    endpoint = f"/api/v1/wyscout/matches/{match_id}"
-    params = {}
-    headers = {
+        return None
+    return {
         "Authorization": f"Bearer {token}",
         "Content-Type": "application/json",
     }
+
+def get_api_match_and_players(config, match_id):
+    # Retried on timeouts, connection errors, 429 and 5xx, a 401 gets a new token once
+    if get_api_headers(config) is None:
+        return
+    endpoint = f"/api/v1/wyscout/matches/{match_id}"
+    params = {}
     url = f"{config['api']['base_url']}{endpoint}{urlencode(params)}"
-    response = requests.get(url, headers=headers)
+
+    def send():
+        return requests.get(url, headers=get_api_headers(config), timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+
+    try:
+        response = request_with_retry(send, breaker=get_breaker("api"), name=f"API request for match {match_id}")
+        if response.status_code == 401:
+            response.close()
+            get_token_provider('test').invalidate()
+            response = request_with_retry(send, breaker=get_breaker("api"), name=f"API request for match {match_id}")
+    except requests.RequestException as e:
+        print(f"Error getting data from API for match {match_id}: {e!r}")
+        return None
     if response.status_code != 200 or response.headers.get('content-type', '').lower() != 'application/json; charset=utf-8':
         print(f"Error getting data from API. Status code: {response.status_code}")
         return None
 
     json_data = response.json()
     response.close()
-    print("API data:", json_data)
     return json_data
 
 
@@ -81,32 +65,17 @@ def get_db_config(file_path):
     return db_config
 
 
-def compare_values(value1, value2):
-    if isinstance(value1, (int, float)) and isinstance(value2, (int, float)):
-        return float(value1) == float(value2)
-    else:
-        return str(value1) == str(value2)
-
-
-def get_db_data(config, query):
-    conn_str = f'DRIVER={{ODBC Driver 18 for SQL Server}};SERVER={config["db"]["server"]};Database={config["db"]["database"]};UID={config["db"]["username"]};PWD={config["db"]["password"]}'
-    with pyodbc.connect(conn_str) as conn:
-        df = pd.read_sql_query(query, conn)  # Change this line
-    return df
-
+def get_db_data(config, match_id):
+    # Returns (db_data, db_players): the match row as dict (None when not found) and the player rows.
+    # The connection comes from the pool of compare_match, shared with every other match of the process.
+    pool = get_db_pool(config)
+    reader = get_db_reader(config)
+    match_df = pool.read_query(build_match_query(mappings), [match_id], reader=reader)
+    players_df = pool.read_query(build_player_query(player_mappings), [match_id], reader=reader)
+    db_data = match_df.to_dict("records")[0] if not match_df.empty else None
+    return db_data, players_df
 
 
-def get_nested_value(data, key_path):
-    keys = key_path.split(".")
-    value = data
-    for key in keys:
-        if "[" in key and "]" in key:
-            key, index = key.split("[")[0], int(key.split("[")[1].split("]")[0])
-            value = value[key][index]
-        else:
-            value = value[key]
-    return value
-
 
 # mappings
 mappings = [
@@ -141,82 +110,15 @@ def compare_match_data(match_id):
     # Load DB configuration
     db_config = get_db_config("../properties/configdb.json")
 
-    # Define your query
-    query = f"""SELECT M.*, S.START_DATE, S.END_DATE, S.NAME as SEASON_NAME, L.GENDER, L.AREA_ID, L.NAME as LEAGUE_NAME, MTP.PLAYER_ID AS PLAYER_ID, MTP.GOALS, MTP.OWN_GOALS, MTP.RED_CARDS, MTP.SHIRT_NUMBER, MTP.YELLOW_CARDS, MTP.MINUTES_PLAYED, MTP.STARTING, MTP.POSITION_1,
-        CASE
-            WHEN MTP.TEAM_ID = M.HOME_TEAM_ID THEN 1
-            ELSE 0
-        END as IS_HOME,
-        TH.NAME as HOME_TEAM_NAME,
-        TA.NAME as AWAY_TEAM_NAME
-    FROM MATCHES M
-    JOIN MATCH_TEAM_PLAYERS MTP ON M.MATCH_ID = MTP.MATCH_ID
-    JOIN SEASONS S ON M.SEASON_ID = S.SEASON_ID
-    JOIN LEAGUES L ON M.LEAGUE_ID = L.LEAGUE_ID
-    JOIN MATCH_TEAMS MTH ON M.MATCH_ID = MTH.MATCH_ID AND MTH.SIDE = 'home'
-    JOIN MATCH_TEAMS MTA ON M.MATCH_ID = MTA.MATCH_ID AND MTA.SIDE = 'away'
-    JOIN TEAMS TH ON M.HOME_TEAM_ID = TH.TEAM_ID
-    JOIN TEAMS TA ON M.AWAY_TEAM_ID = TA.TEAM_ID
-    WHERE M.MATCH_ID = {match_id};"""
-
     # Step 1: Fetch data from the API
     api_data = get_api_match_and_players(config, match_id)
 
     # Step 2: Fetch data from the DB
-    db_df = get_db_data(db_config, query)
+    db_data, db_players = get_db_data(db_config, match_id)
 
     # Step 3: Compare the values
-    comparison_df = pd.DataFrame(columns=['DB Column Name', 'API Name', 'DB Value', 'API Value', 'Match'])
-
-    # Compare match data
-    for mapping in column_mappings:
-        db_column_name, api_name = mapping
-        db_value = db_df.loc[0, db_column_name]
-        api_value = get_nested_value(api_data, api_name)
-        match = compare_values(db_value, api_value)
-
-        comparison_df = pd.concat([comparison_df, pd.DataFrame([{
-            'DB Column Name': db_column_name,
-            'API Name': api_name,
-            'DB Value': db_value,
-            'API Value': api_value,
-            'Match': match
-        }], index=[0])], ignore_index=True)
-
-    # Compare player data
-    for team_type in ["homeTeam", "awayTeam"]:
-        is_home = 1 if team_type == "homeTeam" else 0
-
-        for i, db_player in db_df[db_df['IS_HOME'] == is_home].iterrows():
-            db_shirt_number = db_player['SHIRT_NUMBER']
-            matching_api_player = None
-
-            for api_player in api_data[team_type]["players"]:
-                if api_player["shirtNumber"] == db_shirt_number:
-                    matching_api_player = api_player
-                    break
-
-            if not matching_api_player:
-                print(f"No matching API player found for DB shirt number {db_shirt_number}")
-                continue
-
-            for mapping in player_mappings:
-                db_column_name, api_name = mapping
-
-                # Get the value
-                db_value = db_player[db_column_name]
-                api_value = get_nested_value(matching_api_player, api_name)
-                match = compare_values(db_value, api_value)
-
-                comparison_df = pd.concat([comparison_df, pd.DataFrame([{
-                    'DB Column Name': f"{team_type}.{db_column_name}",
-                    'API Name': api_name,
-                    'DB Value': db_value,
-                    'API Value': api_value,
-                    'Match': match
-                }], index=[0])], ignore_index=True)
-
-    return comparison_df
+    return compare_frames(match_id, api_data, db_data, db_players, mappings, player_mappings,
+                          normalizers=normalizers)
 
 
 
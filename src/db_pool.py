@@ -0,0 +1,164 @@
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+
+class PooledConnection:
+    # A connection of the pool, keeps one cursor per query so the driver can reuse the prepared statement
+    def __init__(self, conn, prepare_statements):
+        self.conn = conn
+        self.prepare_statements = prepare_statements
+        self.cursors = {}
+        self.last_used = time.monotonic()
+
+    def execute(self, query, params=()):
+        cursor = self.cursors.get(query)
+        if cursor is None:
+            cursor = self.conn.cursor()
+            if self.prepare_statements:
+                self.cursors[query] = cursor
+        if params:
+            cursor.execute(query, params)
+        else:
+            cursor.execute(query)
+        return cursor
+
+    def read_query(self, query, params=(), reader=None):
+        # Returns (columns, rows), or what reader(cursor) returns when a reader is given
+        cursor = self.execute(query, params)
+        if reader is None:
+            columns = [column[0] for column in cursor.description]
+            result = columns, cursor.fetchall()
+        else:
+            result = reader(cursor)
+        if not self.prepare_statements:
+            cursor.close()
+        return result
+
+    def close(self):
+        for cursor in self.cursors.values():
+            try:
+                cursor.close()
+            except Exception:
+                pass
+        self.cursors = {}
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    # Thread safe pool of DB connections.
+    # connection_factory is any callable returning a DB-API connection, e.g. pyodbc.connect or sqlite3.connect.
+    # Idle connections are checked with health_check_query when they were not used for health_check_interval seconds.
+    def __init__(self, connection_factory, min_size=1, max_size=5, health_check_query="SELECT 1",
+                 health_check_interval=30, acquire_timeout=30, prepare_statements=True):
+        self.connection_factory = connection_factory
+        self.min_size = min_size
+        self.max_size = max_size
+        self.health_check_query = health_check_query
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+        self.prepare_statements = prepare_statements
+        self.idle = queue.LifoQueue()
+        self.available = threading.BoundedSemaphore(max_size)
+        self.closed = False
+
+        for _ in range(min_size):
+            self.idle.put(self.create_connection())
+
+    def create_connection(self):
+        return PooledConnection(self.connection_factory(), self.prepare_statements)
+
+    def is_healthy(self, pooled):
+        try:
+            pooled.read_query(self.health_check_query)
+            return True
+        except Exception:
+            return False
+
+    def acquire(self):
+        if self.closed:
+            raise RuntimeError("Connection pool is closed")
+        if not self.available.acquire(timeout=self.acquire_timeout):
+            raise TimeoutError(f"No DB connection available within {self.acquire_timeout} seconds")
+        try:
+            while True:
+                try:
+                    pooled = self.idle.get_nowait()
+                except queue.Empty:
+                    return self.create_connection()
+                if time.monotonic() - pooled.last_used < self.health_check_interval or self.is_healthy(pooled):
+                    return pooled
+                # Dropped connection, throw it away and try the next one
+                pooled.close()
+        except BaseException:
+            self.available.release()
+            raise
+
+    def release(self, pooled, broken=False):
+        if broken or self.closed:
+            pooled.close()
+        else:
+            pooled.last_used = time.monotonic()
+            self.idle.put(pooled)
+        self.available.release()
+
+    @contextmanager
+    def connection(self):
+        pooled = self.acquire()
+        broken = False
+        try:
+            yield pooled
+        except Exception:
+            # Keep the connection when only the query failed, drop it when the connection itself is gone
+            broken = not self.is_healthy(pooled)
+            raise
+        finally:
+            self.release(pooled, broken=broken)
+
+    def read_query(self, query, params=(), retries=1, reader=None):
+        # Runs a query and returns (columns, rows) or the result of reader(cursor),
+        # retries on a new connection when the connection dropped
+        for attempt in range(retries + 1):
+            pooled = self.acquire()
+            try:
+                result = pooled.read_query(query, params, reader)
+            except Exception as e:
+                broken = not self.is_healthy(pooled)
+                self.release(pooled, broken=broken)
+                if not broken or attempt == retries:
+                    raise
+                print(f"DB connection dropped, reconnecting: {e}")
+                continue
+            self.release(pooled)
+            return result
+
+    def close(self):
+        self.closed = True
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(key, connection_factory, **kwargs):
+    # One pool per key (e.g. the connection string) for the whole process
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(connection_factory, **kwargs)
+        return _pools[key]
+
+
+def close_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
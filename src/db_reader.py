@@ -0,0 +1,76 @@
+import datetime
+import decimal
+
+import numpy as np
+import pandas as pd
+
+# Column type per Python type pyodbc reports in cursor.description, used for columns missing in the schema
+DESCRIPTION_TYPES = {
+    int: "int",
+    float: "float",
+    decimal.Decimal: "float",
+    bool: "bool",
+    str: "str",
+    datetime.datetime: "datetime",
+    datetime.date: "datetime",
+}
+
+DEFAULT_ARRAYSIZE = 5000
+
+
+def to_column_array(values, column_type):
+    # One fetched batch of a column as typed numpy array, NULL becomes NaN/NaT for float and datetime columns.
+    # Int and bool columns with NULLs stay objects (Python ints and None), floats would turn 123 into 123.0 and
+    # no longer compare equal to the "123" of the API. A batch with NULLs makes the whole column object.
+    if column_type == "int" and None not in values:
+        return np.array(values, dtype=np.int64)
+    if column_type == "float":
+        return np.array(values, dtype=np.float64)
+    if column_type == "bool" and None not in values:
+        return np.array(values, dtype=bool)
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    if column_type == "datetime":
+        # pandas converts datetime objects a lot faster than numpy does
+        return pd.to_datetime(array).to_numpy()
+    return array
+
+
+def get_column_types(cursor, schema):
+    return [schema.get(column[0]) or DESCRIPTION_TYPES.get(column[1], "object") for column in cursor.description]
+
+
+def read_frame(cursor, schema=None, arraysize=DEFAULT_ARRAYSIZE):
+    # Reads the result of an executed cursor into a DataFrame with one typed column per result column.
+    # schema maps column names to "int", "float", "bool", "str", "datetime" or "object",
+    # the type of other columns comes from the cursor description.
+    # Rows are fetched arraysize at a time and turned into column arrays straight away,
+    # so only one batch of row objects is in memory at a time.
+    columns = [column[0] for column in cursor.description]
+    column_types = get_column_types(cursor, schema or {})
+    cursor.arraysize = arraysize
+    batches = [[] for _ in columns]
+    while True:
+        rows = cursor.fetchmany(arraysize)
+        if not rows:
+            break
+        for batch, values, column_type in zip(batches, zip(*rows), column_types):
+            batch.append(to_column_array(values, column_type))
+
+    data = {}
+    for column, batch, column_type in zip(columns, batches, column_types):
+        if not batch:
+            data[column] = to_column_array((), column_type)
+        elif len(batch) == 1:
+            data[column] = batch[0]
+        else:
+            data[column] = np.concatenate(batch)
+        if column_type == "object":
+            # Untyped columns get the dtype pandas would infer
+            data[column] = pd.Series(data[column]).infer_objects()
+    return pd.DataFrame(data, columns=columns, copy=False)
+
+
+def frame_reader(schema=None, arraysize=DEFAULT_ARRAYSIZE):
+    # Reader for ConnectionPool.read_query and PooledConnection.read_query
+    return lambda cursor: read_frame(cursor, schema, arraysize)
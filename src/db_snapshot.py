@@ -0,0 +1,121 @@
+import datetime
+import json
+import os
+import uuid
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+MATCHES_FILE = "matches.arrow"
+PLAYERS_FILE = "players.arrow"
+INFO_FILE = "snapshot.json"
+
+
+def get_arrow_type(column_type):
+    # Arrow type of a declared column type (see query_builder.COLUMN_TYPES), None for untyped columns
+    arrow_types = {
+        "int": pa.int64(),
+        "float": pa.float64(),
+        "bool": pa.bool_(),
+        "str": pa.string(),
+        "datetime": pa.timestamp("us"),
+    }
+    return arrow_types.get(column_type)
+
+
+class SnapshotWriter:
+    # Writes the DB side of many matches to a snapshot directory with an Arrow IPC file for the match rows
+    # (with the DB checksum of every match) and one for the player rows.
+    # The files are written under a temporary name and only replace an older snapshot on close.
+    # checksum_columns names the parts of the DB checksums, so readers can tell checksums of another query apart.
+    def __init__(self, path, environment, column_types=None, checksum_columns=None):
+        if pa is None:
+            raise ImportError("pyarrow is needed for DB snapshots, pip install pyarrow")
+        self.path = path
+        self.environment = environment
+        self.column_types = column_types or {}
+        self.checksum_columns = checksum_columns
+        self.tmp_suffix = f".{uuid.uuid4().hex}.tmp"
+        self.writers = {}
+        self.match_count = 0
+        os.makedirs(path, exist_ok=True)
+
+    def get_schema(self, df):
+        schema = pa.Schema.from_pandas(df, preserve_index=False)
+        for index, field in enumerate(schema):
+            arrow_type = get_arrow_type(self.column_types.get(field.name))
+            if arrow_type is not None:
+                schema = schema.set(index, pa.field(field.name, arrow_type))
+        return schema
+
+    def write_frame(self, file_name, df):
+        if file_name not in self.writers:
+            schema = self.get_schema(df)
+            self.writers[file_name] = pa.ipc.new_file(os.path.join(self.path, file_name + self.tmp_suffix), schema), schema
+        writer, schema = self.writers[file_name]
+        writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+
+    def write(self, match_df, players_df, checksums):
+        # match_df and players_df are the results of the batch queries, checksums is {match_id: DB checksum}
+        match_df = match_df.assign(DB_CHECKSUM=[checksums.get(int(match_id)) for match_id in match_df["MATCH_ID"]])
+        self.write_frame(MATCHES_FILE, match_df)
+        self.write_frame(PLAYERS_FILE, players_df)
+        self.match_count += len(match_df)
+
+    def abort(self):
+        # Drops the files written so far, an older snapshot in the same directory stays as it was
+        for file_name, (writer, _) in self.writers.items():
+            writer.close()
+            os.remove(os.path.join(self.path, file_name + self.tmp_suffix))
+        self.writers = {}
+
+    def close(self):
+        for file_name, (writer, _) in self.writers.items():
+            writer.close()
+            os.replace(os.path.join(self.path, file_name + self.tmp_suffix), os.path.join(self.path, file_name))
+        with open(os.path.join(self.path, INFO_FILE), 'w') as f:
+            json.dump({"environment": self.environment, "matches": self.match_count,
+                       "created_at": datetime.datetime.now().isoformat(timespec='seconds'),
+                       "checksum_columns": self.checksum_columns}, f)
+        self.writers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class Snapshot:
+    # Reads a snapshot written by SnapshotWriter. The Arrow files are memory mapped, so opening a snapshot
+    # reads nothing and only the rows of the requested matches are copied out of the mapped files.
+    def __init__(self, path):
+        if pa is None:
+            raise ImportError("pyarrow is needed for DB snapshots, pip install pyarrow")
+        self.path = path
+        with open(os.path.join(path, INFO_FILE)) as f:
+            self.info = json.load(f)
+        self.matches = self.read_table(MATCHES_FILE)
+        self.players = self.read_table(PLAYERS_FILE)
+        # {match_id: DB checksum at the time of the snapshot}
+        self.checksums = dict(zip(self.matches.column("MATCH_ID").to_pylist(),
+                                  self.matches.column("DB_CHECKSUM").to_pylist()))
+
+    def read_table(self, file_name):
+        return pa.ipc.open_file(pa.memory_map(os.path.join(self.path, file_name))).read_all()
+
+    def get_frames(self, match_ids):
+        # Returns (match_df, players_df) of the matches in match_ids, like the batch queries return them
+        value_set = pa.array([int(match_id) for match_id in match_ids], type=pa.int64())
+        match_table = self.matches.filter(pa.compute.is_in(self.matches.column("MATCH_ID"), value_set=value_set))
+        players_table = self.players.filter(pa.compute.is_in(self.players.column("MATCH_ID"), value_set=value_set))
+        match_table = match_table.select([name for name in match_table.column_names if name != "DB_CHECKSUM"])
+        # Int columns with NULLs as Python ints and None like db_reader reads them, not as floats
+        return match_table.to_pandas(integer_object_nulls=True), players_table.to_pandas(integer_object_nulls=True)
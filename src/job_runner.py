@@ -0,0 +1,127 @@
+import datetime
+import json
+import os
+import time
+
+from compare_batch import compare_match_batch
+from parallel_runner import compare_match_parallel
+from resilience import get_backoff_delay
+
+# Failures that do not go away by trying again
+PERMANENT_FAILURES = {"no_db_rows"}
+
+
+class Journal:
+    # Append-only JSON lines file with the outcome of the matches of a job, the last line of a match counts:
+    # "done", "failed" (with a reason, tried again) or "gave_up" (not tried again).
+    # Every record call is one write to the end of the file, so parallel workers can share the journal.
+    # Only the path is stored on the object, so it can be passed to worker processes.
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        # Returns {match_id: last entry}
+        entries = {}
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Half written line of a process that died
+                    continue
+                entries[entry["match_id"]] = entry
+        return entries
+
+    def record(self, done=(), failed=None, status="failed"):
+        # done is a list of match ids, failed is {match_id: reason}, status is "failed" or "gave_up"
+        now = datetime.datetime.now().isoformat(timespec='seconds')
+        lines = [json.dumps({"match_id": int(match_id), "status": "done", "at": now}) + "\n" for match_id in done]
+        lines += [json.dumps({"match_id": int(match_id), "status": status, "reason": reason, "at": now}) + "\n"
+                  for match_id, reason in (failed or {}).items()]
+        if not lines:
+            return
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, "".join(lines).encode())
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def run_job(environment, match_ids, csv_filename, journal_file, max_attempts=5, backoff=2.0, max_backoff=300.0,
+            retry_gave_up=False, workers=None, **batch_options):
+    # Resumable batch run: compares match_ids with compare_match_batch (compare_match_parallel with workers)
+    # and journals the outcome of every match in journal_file after every chunk. When the job is started again
+    # with the same journal_file the finished matches are skipped, so it continues where it stopped.
+    # Matches that failed (no API data, or the run stopped with an error) are tried again after a backoff,
+    # up to max_attempts runs. Matches without DB rows are given up right away, retry_gave_up tries them again.
+    # Use an output_file in batch_options, so the results of all runs of the job end up in one file.
+    # match_ids can be a generator (e.g. discover_match_ids), the first run compares the ids while they stream in.
+    # Returns the match ids that were given up.
+    journal = Journal(journal_file)
+    entries = journal.load()
+    finished_statuses = {"done"} if retry_gave_up else {"done", "gave_up"}
+    seen = set()
+    job_match_ids = []
+    first_pending = []
+
+    def stream_pending(entries):
+        for match_id in match_ids:
+            match_id = int(match_id)
+            if match_id in seen:
+                continue
+            seen.add(match_id)
+            job_match_ids.append(match_id)
+            if entries.get(match_id, {}).get("status") not in finished_statuses:
+                first_pending.append(match_id)
+                yield match_id
+
+    pending = stream_pending(entries)
+    for attempt in range(1, max_attempts + 1):
+        if attempt > 1:
+            if not pending:
+                break
+            delay = get_backoff_delay(attempt - 1, backoff, max_backoff)
+            print(f"Trying {len(pending)} matches again in {delay:.1f} seconds (attempt {attempt} of {max_attempts}).")
+            time.sleep(delay)
+
+        try:
+            if workers:
+                failed_match_ids = compare_match_parallel(environment, pending, csv_filename, workers,
+                                                          journal=journal, **batch_options)
+            else:
+                failed_match_ids = compare_match_batch(environment, pending, csv_filename, journal=journal,
+                                                       **batch_options)
+        except Exception as e:
+            # The matches of the chunks that finished are in the journal, the others are tried again
+            print(f"Run {attempt} stopped with an error: {e!r}")
+            failed_match_ids = None
+        if attempt == 1:
+            # The ids the first run did not get to when it stopped are tried in the next run
+            for _ in pending:
+                pass
+            pending = first_pending
+            print(f"{len(job_match_ids) - len(pending)} of {len(job_match_ids)} matches were already finished.")
+        if failed_match_ids is not None:
+            # Matches that were skipped as unchanged (state_file) are not journaled per chunk
+            failed = set(failed_match_ids)
+            entries = journal.load()
+            journal.record(done=[match_id for match_id in pending if match_id not in failed
+                                 and entries.get(match_id, {}).get("status") != "done"])
+
+        entries = journal.load()
+        permanent = {match_id: entries[match_id]["reason"] for match_id in pending
+                     if entries.get(match_id, {}).get("status") == "failed"
+                     and entries[match_id].get("reason") in PERMANENT_FAILURES}
+        journal.record(failed=permanent, status="gave_up")
+        pending = [match_id for match_id in pending
+                   if entries.get(match_id, {}).get("status") != "done" and match_id not in permanent]
+
+    journal.record(failed={match_id: "max_attempts" for match_id in pending}, status="gave_up")
+    entries = journal.load()
+    gave_up = [match_id for match_id in job_match_ids if entries.get(match_id, {}).get("status") == "gave_up"]
+    print(f"Job finished: {len(job_match_ids) - len(gave_up)} of {len(job_match_ids)} matches done, "
+          f"{len(gave_up)} given up.")
+    return gave_up
@@ -1,4 +1,12 @@
 from compare_match import compare_match
+from compare_batch import compare_match_batch, create_db_snapshot
+from job_runner import run_job
+from match_discovery import discover_match_ids
+from match_sampling import compare_match_sample
+from parallel_runner import compare_match_parallel
+from response_cache import ResponseCache
+from result_sink import open_sink
+import metrics
 import random
 
 def main():
@@ -6,11 +14,83 @@ def main():
     # match_ids = random.sample(range(5034295, 5034305), 10)  # generate 10 random match ids
     match_ids = [5445752]  # generate 10 random match ids
     environment = 'test' # prod or test
-    for match_id in match_ids:
-        compare_match(environment, match_id, csv_filename=csv_filename+str(match_id)+".csv")
-    print("find csv files in docs folder.")
+    discover = None # e.g. {"season_id": 188105}, {"league_id": [364, 365]} or
+                    # {"kickoff_from": "2024-08-01", "kickoff_to": "2024-09-01"} to compare the matches the DB has
+                    # for it instead of match_ids, the ids stream in from the DB while the first matches are compared
+    if discover:
+        match_ids = discover_match_ids(environment, **discover)
+    batch = False # True to fetch the DB rows of all match ids with set based queries
+    state_file = None # e.g. "../docs/compare_state.sqlite" to only compare matches that changed since the last batch run
+    workers = None # number of processes for batch runs, None runs the batch in this process
+    output_file = None # e.g. "../docs/compare_results.csv.gz" to write all results of a batch run to one file,
+                       # or "../docs/compare_results.parquet" for a partitioned Parquet dataset
+    mismatches_only = False # True to only write the fields that do not match
+    summary_file = None # e.g. "../docs/compare_summary" for counts per match and per mapping
+    metrics_file = None # e.g. "../docs/metrics.prom" (Prometheus text) or "../docs/metrics.jsonl" for timings per stage
+    if metrics_file:
+        metrics.enable(environment)
+    cache_dir = None # e.g. "../docs/api_cache" to keep the API responses on disk and reuse them in the next runs
+    cache_ttl = 24 * 60 * 60 # seconds a cached API response is used, None forever
+    cache_max_bytes = 1024 ** 3 # the least recently used responses are removed above this size
+    offline = False # True to only replay cached API responses, without calling the API
+    cache = ResponseCache(cache_dir, cache_ttl, cache_max_bytes, offline) if cache_dir else None
+    snapshot_path = None # e.g. "../docs/db_snapshot" to read the DB side of batch runs from a local snapshot
+    create_snapshot = False # True to (re)write the snapshot of match_ids first
+    check_snapshot = True # False to not use the DB at all, also not to check whether the snapshot is up to date
+    journal_file = None # e.g. "../docs/compare_job.jsonl" to run the batch as a job that continues where it stopped
+    sample_file = None # e.g. "../docs/compare_sample" to compare a stratified random sample of the matches of discover
+                       # (all matches without discover) instead of match_ids, and estimate the mismatch rates
+    confidence = 0.95 # confidence level of the estimated mismatch rates
+    margin = 0.05 # margin of error of the estimated mismatch rates, decides the sample size
+    if not batch and not sample_file and (state_file or snapshot_path or journal_file):
+        raise ValueError("state_file, snapshot_path and journal_file only work for batch runs, set batch = True")
+    if sample_file and (state_file or journal_file or output_file):
+        # Skipped or resumed matches would be missing from the estimates, the sample writes its own output files
+        raise ValueError("state_file, journal_file and output_file do not work with a sample_file")
+    if snapshot_path and create_snapshot:
+        create_db_snapshot(environment, match_ids, snapshot_path)
+        if discover:
+            # The snapshot used up the discovered ids
+            match_ids = discover_match_ids(environment, **discover)
+    if sample_file:
+        compare_match_sample(environment, csv_filename, sample_file, workers=workers, confidence=confidence,
+                             margin=margin, filters=discover, cache=cache, summary_file=summary_file,
+                             snapshot_path=snapshot_path, check_snapshot=check_snapshot)
+    elif batch and journal_file:
+        failed_match_ids = run_job(environment, match_ids, csv_filename, journal_file, workers=workers,
+                                   state_file=state_file, output_file=output_file, summary_file=summary_file,
+                                   mismatches_only=mismatches_only, cache=cache, snapshot_path=snapshot_path,
+                                   check_snapshot=check_snapshot)
+        if failed_match_ids:
+            print(f"Failed matches: {failed_match_ids}")
+    elif batch:
+        if workers:
+            failed_match_ids = compare_match_parallel(environment, match_ids, csv_filename, workers,
+                                                      state_file=state_file, output_file=output_file,
+                                                      summary_file=summary_file, mismatches_only=mismatches_only,
+                                                      cache=cache, snapshot_path=snapshot_path,
+                                                      check_snapshot=check_snapshot)
+        else:
+            failed_match_ids = compare_match_batch(environment, match_ids, csv_filename, state_file=state_file,
+                                                   output_file=output_file, summary_file=summary_file,
+                                                   mismatches_only=mismatches_only, cache=cache,
+                                                   snapshot_path=snapshot_path, check_snapshot=check_snapshot)
+        if failed_match_ids:
+            print(f"Failed matches: {failed_match_ids}")
+    else:
+        # Without output_file every match gets its own CSV file, csv_filename + match id + .csv
+        with open_sink(output_file, csv_filename, environment=environment, summary_file=summary_file,
+                       mismatches_only=mismatches_only) as sink:
+            for match_id in match_ids:
+                compare_match(environment, match_id, cache=cache, sink=sink)
+    if metrics_file:
+        metrics.write(metrics_file)
+    if sample_file:
+        print(f"find the sample results in {sample_file}_mismatches.csv and {sample_file}_estimates.csv.")
+    elif output_file:
+        print(f"find the results in {output_file}.")
+    else:
+        print("find csv files in docs folder.")
 
 if __name__ == "__main__":
     main()
-
-
@@ -0,0 +1,62 @@
+import re
+from functools import lru_cache
+
+
+# Marks a [*] step, the rest of the path is taken from every item of the list
+WILDCARD = object()
+
+# Default of CompiledPath.get, raise instead of returning a default
+MISSING = object()
+
+_STEP_PATTERN = re.compile(r"\[(\d+|\*)\]")
+
+
+class CompiledPath:
+    # A parsed API path like "homeTeam.sourceReferences[0].sourceValue" or "players[*].shirtNumber".
+    # steps is a tuple of dict keys, list indexes and WILDCARD, so looking up a value needs no string parsing.
+    def __init__(self, path, steps):
+        self.path = path
+        self.steps = steps
+
+    def __repr__(self):
+        return f"CompiledPath({self.path!r})"
+
+    def get(self, data, default=MISSING):
+        # Like get_nested_value, a [*] step returns a list with one value per item.
+        # With a default, missing keys or indexes give the default (per item for [*]) instead of an error.
+        return self._get(data, 0, default)
+
+    def _get(self, value, start, default):
+        steps = self.steps
+        for position in range(start, len(steps)):
+            step = steps[position]
+            if step is WILDCARD:
+                return [self._get(item, position + 1, default) for item in value]
+            try:
+                value = value[step]
+            except (KeyError, IndexError, TypeError):
+                if default is MISSING:
+                    raise
+                return default
+        return value
+
+
+def parse_path(path):
+    steps = []
+    for key in path.split("."):
+        name = key.split("[", 1)[0]
+        if name:
+            steps.append(name)
+        for index in _STEP_PATTERN.findall(key[len(name):]):
+            steps.append(WILDCARD if index == "*" else int(index))
+    return tuple(steps)
+
+
+@lru_cache(maxsize=None)
+def compile_path(path):
+    return CompiledPath(path, parse_path(path))
+
+
+def compile_mappings(mappings):
+    # [(db_column_name, api_name)] -> [(db_column_name, api_name, CompiledPath)]
+    return [(db_column_name, api_name, compile_path(api_name)) for db_column_name, api_name in mappings]
@@ -0,0 +1,55 @@
+import datetime
+
+from compare_match import get_config_files, get_db_config, get_db_pool
+from query_builder import build_discovery_query
+import metrics
+
+
+def as_list(value):
+    # One id or several ids
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple, set, range)):
+        return list(value)
+    return [value]
+
+
+def as_datetime(value):
+    # Dates can be given as "2024-08-01" or "2024-08-01 15:00:00"
+    if isinstance(value, str):
+        return datetime.datetime.fromisoformat(value)
+    return value
+
+
+def get_discovery_pool(environment, season_id, league_id, kickoff_from, kickoff_to):
+    if season_id is None and league_id is None and kickoff_from is None and kickoff_to is None:
+        raise ValueError("Pick the matches to discover with a season_id, league_id, kickoff_from or kickoff_to")
+    _, db_config_file = get_config_files(environment)
+    return get_db_pool(get_db_config(db_config_file))
+
+
+def read_match_pages(pool, query, filter_params, page_size=5000, after_match_id=0):
+    # Yields the rows of a keyset paginated query of build_discovery_query, page by page
+    last_match_id = after_match_id
+    while True:
+        with metrics.timer("discovery_page"):
+            _, rows = pool.read_query(query, [page_size, last_match_id] + filter_params)
+        metrics.count("matches_discovered", len(rows))
+        yield from rows
+        if len(rows) < page_size:
+            return
+        last_match_id = int(rows[-1][0])
+
+
+def discover_match_ids(environment, season_id=None, league_id=None, kickoff_from=None, kickoff_to=None,
+                       page_size=5000, after_match_id=0):
+    # Yields the ids of the matches in the DB of environment for a season, a league and/or a kickoff window
+    # [kickoff_from, kickoff_to), in match id order. season_id and league_id are one id or a list of ids.
+    # The ids are read page by page with one keyset paginated query, so the first matches can be compared while
+    # the rest is not read yet. No connection is held between pages. after_match_id skips the ids up to it,
+    # e.g. to continue after the last match of an earlier run.
+    pool = get_discovery_pool(environment, season_id, league_id, kickoff_from, kickoff_to)
+    query, filter_params = build_discovery_query(as_list(season_id), as_list(league_id), as_datetime(kickoff_from),
+                                                 as_datetime(kickoff_to))
+    for row in read_match_pages(pool, query, filter_params, page_size, after_match_id):
+        yield int(row[0])
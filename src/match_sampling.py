@@ -0,0 +1,191 @@
+import csv
+import math
+import os
+import random
+from statistics import NormalDist
+
+import pandas as pd
+
+from compare_match import mappings, player_mappings, get_config_files, get_db_config, get_db_pool
+from compare_batch import compare_match_batch
+from parallel_runner import compare_match_parallel
+from match_discovery import as_list, as_datetime, read_match_pages
+from query_builder import build_discovery_query, build_stratum_query
+
+
+def get_z(confidence):
+    # Two sided critical value of the normal distribution, 1.96 for 0.95
+    return NormalDist().inv_cdf((1 + confidence) / 2)
+
+
+def get_sample_size(population, confidence=0.95, margin=0.05, expected_rate=0.5):
+    # Matches needed to estimate a mismatch rate within +/- margin at the confidence level, with the finite
+    # population correction. expected_rate 0.5 is the worst case, a lower expected rate needs fewer matches.
+    if population <= 0:
+        return 0
+    z = get_z(confidence)
+    sample_size = z ** 2 * expected_rate * (1 - expected_rate) / margin ** 2
+    return min(population, math.ceil(sample_size / (1 + (sample_size - 1) / population)))
+
+
+def allocate_sample(stratum_sizes, sample_size, min_per_stratum=2):
+    # Proportional allocation of sample_size over the strata ({stratum: size}) with the largest remainders,
+    # every stratum gets at least min_per_stratum matches (or all of them) so its variance can be estimated
+    population = sum(stratum_sizes.values())
+    if population == 0:
+        return {stratum: 0 for stratum in stratum_sizes}
+    shares = {stratum: sample_size * size / population for stratum, size in stratum_sizes.items()}
+    allocation = {stratum: int(share) for stratum, share in shares.items()}
+    remainders = sorted(shares, key=lambda stratum: shares[stratum] - allocation[stratum], reverse=True)
+    for stratum in remainders[:sample_size - sum(allocation.values())]:
+        allocation[stratum] += 1
+    return {stratum: min(stratum_sizes[stratum], max(count, min_per_stratum))
+            for stratum, count in allocation.items()}
+
+
+class StratifiedSample:
+    # Stratified random sample of the matches in the DB of environment, the strata are league and season.
+    # The filters (season_id, league_id, kickoff_from, kickoff_to, see discover_match_ids) limit the population,
+    # without filters all matches are the population. The sample size follows from the confidence level and the
+    # margin of error on the mismatch rate (see get_sample_size) and is allocated proportionally to the strata.
+    # match_ids() streams the sampled ids in match id order, estimate() turns the mismatches into estimated
+    # mismatch rates with confidence intervals. A seed makes the sample reproducible.
+    def __init__(self, environment, confidence=0.95, margin=0.05, expected_rate=0.5, min_per_stratum=2, seed=None,
+                 season_id=None, league_id=None, kickoff_from=None, kickoff_to=None, page_size=5000):
+        self.environment = environment
+        self.confidence = confidence
+        self.seed = seed
+        self.page_size = page_size
+        self.filters = (as_list(season_id), as_list(league_id), as_datetime(kickoff_from), as_datetime(kickoff_to))
+        _, db_config_file = get_config_files(environment)
+        self.pool = get_db_pool(get_db_config(db_config_file))
+
+        query, params = build_stratum_query(*self.filters)
+        _, rows = self.pool.read_query(query, params)
+        self.stratum_sizes = {(row[0], row[1]): int(row[2]) for row in rows}
+        self.population = sum(self.stratum_sizes.values())
+        self.sample_size = get_sample_size(self.population, confidence, margin, expected_rate)
+        self.allocation = allocate_sample(self.stratum_sizes, self.sample_size, min_per_stratum)
+        # Stratum of every sampled match, filled while match_ids() streams
+        self.strata = {}
+        print(f"Sampling {sum(self.allocation.values())} of {self.population} matches in "
+              f"{len(self.stratum_sizes)} league/season strata ({confidence:.0%} confidence, +/- {margin:.1%}).")
+
+    def match_ids(self):
+        # Selection sampling (Knuth's algorithm S) per stratum in one pass over the population: every match is
+        # taken with the chance (still needed) / (still to come) of its stratum, which gives exactly the allocated
+        # number of matches per stratum without holding the population in memory
+        rng = random.Random(self.seed)
+        seen = {}
+        taken = {}
+        query, filter_params = build_discovery_query(*self.filters, columns=("LEAGUE_ID", "SEASON_ID"))
+        for match_id, league_id, season_id in read_match_pages(self.pool, query, filter_params, self.page_size):
+            stratum = (league_id, season_id)
+            needed = self.allocation.get(stratum, 0) - taken.get(stratum, 0)
+            # The DB can change between counting and reading, then the rest of the stratum is taken
+            remaining = max(self.stratum_sizes.get(stratum, 0) - seen.get(stratum, 0), 1)
+            seen[stratum] = seen.get(stratum, 0) + 1
+            if needed > 0 and rng.random() * remaining < needed:
+                taken[stratum] = taken.get(stratum, 0) + 1
+                self.strata[int(match_id)] = stratum
+                yield int(match_id)
+
+    def estimate(self, mismatched_mappings, failed_match_ids=()):
+        # mismatched_mappings is {match_id: set of DB Column Names with a mismatch} of the compared matches.
+        # Returns one row per mapping, and one for any mapping, with the estimated share of matches that have a
+        # mismatch in it: the stratified estimate sum(W_h * p_h), and a Wilson interval on the effective sample
+        # size of the stratified variance. Failed matches are left out, strata without compared matches are
+        # left out of the weights.
+        failed = set(failed_match_ids)
+        compared = {}
+        for match_id, stratum in self.strata.items():
+            if match_id not in failed:
+                compared.setdefault(stratum, []).append(match_id)
+        covered = sum(self.stratum_sizes[stratum] for stratum in compared)
+        if covered < self.population:
+            print(f"{self.population - covered} of {self.population} matches are in strata without compared matches, "
+                  f"the estimates only cover the other strata.")
+
+        names = list(dict.fromkeys([db_column_name for db_column_name, _ in mappings + player_mappings]
+                                   + sorted({name for names in mismatched_mappings.values() for name in names})))
+        z = get_z(self.confidence)
+        rows = []
+        for name in names + [None]:
+            rate = 0.0
+            variance = 0.0
+            mismatching = 0
+            for stratum, match_ids in compared.items():
+                size = self.stratum_sizes[stratum]
+                count = len(match_ids)
+                stratum_mismatching = sum(1 for match_id in match_ids
+                                          if has_mismatch(mismatched_mappings.get(match_id, set()), name))
+                mismatching += stratum_mismatching
+                weight = size / covered
+                stratum_rate = stratum_mismatching / count
+                rate += weight * stratum_rate
+                if count > 1:
+                    variance += weight ** 2 * (1 - count / size) * stratum_rate * (1 - stratum_rate) / (count - 1)
+            sampled = sum(len(match_ids) for match_ids in compared.values())
+            low, high = get_wilson_interval(rate, variance, sampled, z)
+            rows.append({"Mapping": name if name is not None else "(any)", "Sampled Matches": sampled,
+                         "Mismatching Matches": mismatching, "Estimated Rate": rate, "CI Low": low, "CI High": high})
+        return rows
+
+
+def has_mismatch(mismatched, name):
+    # name None stands for any mapping
+    return bool(mismatched) if name is None else name in mismatched
+
+
+def get_wilson_interval(rate, variance, sampled, z):
+    # Wilson score interval with the effective sample size rate * (1 - rate) / variance, so it stays sensible
+    # for rates of 0 and 1 where the normal interval collapses to a point
+    if sampled == 0:
+        return 0.0, 1.0
+    effective = rate * (1 - rate) / variance if variance > 0 else sampled
+    denominator = 1 + z ** 2 / effective
+    center = (rate + z ** 2 / (2 * effective)) / denominator
+    half_width = z / denominator * math.sqrt(rate * (1 - rate) / effective + z ** 2 / (4 * effective ** 2))
+    return max(0.0, center - half_width), min(1.0, center + half_width)
+
+
+def read_mismatched_mappings(results_file):
+    # {match_id: set of DB Column Names} from a CSV output_file written with mismatches_only
+    if not os.path.exists(results_file) or os.path.getsize(results_file) == 0:
+        return {}
+    results = pd.read_csv(results_file, usecols=['Match ID', 'DB Column Name'])
+    return {int(match_id): set(names)
+            for match_id, names in results.groupby('Match ID')['DB Column Name']}
+
+
+def write_estimates(file_name, rows):
+    with open(file_name, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def compare_match_sample(environment, csv_filename, sample_file, workers=None, confidence=0.95, margin=0.05,
+                         expected_rate=0.5, min_per_stratum=2, seed=None, filters=None, **batch_options):
+    # Compares a stratified random sample (see StratifiedSample) instead of every match, filters are the
+    # population filters of discover_match_ids. The mismatching fields go to <sample_file>_mismatches.csv,
+    # the estimated mismatch rates per mapping with their confidence intervals to <sample_file>_estimates.csv.
+    # batch_options are passed on to compare_match_batch. Returns the estimate rows.
+    sample = StratifiedSample(environment, confidence, margin, expected_rate, min_per_stratum, seed, **(filters or {}))
+    results_file = sample_file + "_mismatches.csv"
+    # The estimates are read back from this file, mismatches of an earlier sample would count
+    if os.path.exists(results_file):
+        os.remove(results_file)
+    if workers:
+        failed_match_ids = compare_match_parallel(environment, sample.match_ids(), csv_filename, workers,
+                                                  output_file=results_file, mismatches_only=True, **batch_options)
+    else:
+        failed_match_ids = compare_match_batch(environment, sample.match_ids(), csv_filename,
+                                               output_file=results_file, mismatches_only=True, **batch_options)
+
+    rows = sample.estimate(read_mismatched_mappings(results_file), failed_match_ids)
+    write_estimates(sample_file + "_estimates.csv", rows)
+    for row in rows:
+        print(f"{row['Mapping']:<20}{row['Estimated Rate']:>8.2%} mismatching "
+              f"({row['CI Low']:.2%} - {row['CI High']:.2%}, {row['Mismatching Matches']} of {row['Sampled Matches']})")
+    return rows
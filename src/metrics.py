@@ -0,0 +1,187 @@
+import json
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+
+import numpy as np
+
+# Timings per stage and counters, labelled with the environment of the run.
+# Disabled by default: timer and count then return straight away, so the instrumented code pays one global lookup.
+# Use as:
+#   metrics.enable("test")
+#   with metrics.timer("db_fetch"): ...
+#   metrics.count("mismatches", 3)
+#   metrics.gauge("api_concurrency_limit", 12)
+#   metrics.write("../docs/metrics.prom")
+
+QUANTILES = [0.5, 0.9, 0.95, 0.99]
+
+PROMETHEUS_PREFIX = "compare_match"
+
+enabled = False
+environment = None
+durations = {}
+counters = {}
+gauges = {}
+lock = threading.Lock()
+
+
+def enable(run_environment=None):
+    global enabled, environment
+    enabled = True
+    environment = run_environment
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def set_environment(run_environment):
+    # Label of the following measurements, e.g. when one process compares several environments
+    global environment
+    environment = run_environment
+
+
+def reset():
+    with lock:
+        durations.clear()
+        counters.clear()
+        gauges.clear()
+
+
+def observe(stage, seconds):
+    if not enabled:
+        return
+    key = (stage, environment)
+    with lock:
+        if key not in durations:
+            durations[key] = array('d')
+        durations[key].append(seconds)
+
+
+class NoTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NO_TIMER = NoTimer()
+
+
+@contextmanager
+def running_timer(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def timer(stage):
+    # Times the with block as one observation of stage, also when it raises
+    if not enabled:
+        return NO_TIMER
+    return running_timer(stage)
+
+
+def count(name, value=1):
+    if not enabled:
+        return
+    key = (name, environment)
+    with lock:
+        counters[key] = counters.get(key, 0) + value
+
+
+def gauge(name, value):
+    # Current value of something that goes up and down, e.g. a concurrency limit
+    if not enabled:
+        return
+    with lock:
+        gauges[(name, environment)] = value
+
+
+def get_samples():
+    # Raw measurements, e.g. to send them from a worker process to the main process
+    with lock:
+        return ({key: values.tolist() for key, values in durations.items()}, dict(counters), dict(gauges))
+
+
+def merge_samples(samples):
+    # Adds the measurements of get_samples of another process, gauges keep the value merged last
+    stage_durations, stage_counters, stage_gauges = samples
+    with lock:
+        for key, values in stage_durations.items():
+            durations.setdefault(key, array('d')).extend(values)
+        for key, value in stage_counters.items():
+            counters[key] = counters.get(key, 0) + value
+        gauges.update(stage_gauges)
+
+
+def summarize():
+    # Returns one dict per stage and environment with the count, sum, max and quantiles in seconds,
+    # and one dict per counter and gauge
+    with lock:
+        stage_durations = {key: np.frombuffer(values, dtype=np.float64).copy() for key, values in durations.items()}
+        stage_counters = dict(counters)
+        stage_gauges = dict(gauges)
+    rows = []
+    for (stage, stage_environment), values in sorted(stage_durations.items(), key=lambda item: str(item[0])):
+        row = {"type": "timer", "stage": stage, "environment": stage_environment, "count": len(values),
+               "sum": float(values.sum()), "max": float(values.max()) if len(values) else 0.0}
+        for quantile in QUANTILES:
+            row[f"p{int(quantile * 100)}"] = float(np.quantile(values, quantile)) if len(values) else 0.0
+        rows.append(row)
+    for (name, counter_environment), value in sorted(stage_counters.items(), key=lambda item: str(item[0])):
+        rows.append({"type": "counter", "name": name, "environment": counter_environment, "value": value})
+    for (name, gauge_environment), value in sorted(stage_gauges.items(), key=lambda item: str(item[0])):
+        rows.append({"type": "gauge", "name": name, "environment": gauge_environment, "value": value})
+    return rows
+
+
+def write_json_lines(path):
+    with open(path, 'w') as f:
+        for row in summarize():
+            f.write(json.dumps(row) + "\n")
+
+
+def format_labels(labels):
+    labels = [f'{name}="{value}"' for name, value in labels.items() if value is not None]
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def write_prometheus(path):
+    # Prometheus text format, e.g. for the textfile collector of the node exporter
+    rows = summarize()
+    lines = [f"# TYPE {PROMETHEUS_PREFIX}_stage_seconds summary"]
+    for row in rows:
+        if row["type"] != "timer":
+            continue
+        labels = {"stage": row["stage"], "environment": row["environment"]}
+        for quantile in QUANTILES:
+            lines.append(f"{PROMETHEUS_PREFIX}_stage_seconds"
+                         f"{format_labels(dict(labels, quantile=quantile))} {row[f'p{int(quantile * 100)}']}")
+        lines.append(f"{PROMETHEUS_PREFIX}_stage_seconds_sum{format_labels(labels)} {row['sum']}")
+        lines.append(f"{PROMETHEUS_PREFIX}_stage_seconds_count{format_labels(labels)} {row['count']}")
+    metric_lines = {}
+    for row in rows:
+        if row["type"] in ("counter", "gauge"):
+            name = f"{PROMETHEUS_PREFIX}_{row['name']}" + ("_total" if row["type"] == "counter" else "")
+            metric_lines.setdefault((name, row["type"]), []).append(
+                f"{name}{format_labels({'environment': row['environment']})} {row['value']}")
+    for (name, metric_type), name_lines in metric_lines.items():
+        lines.append(f"# TYPE {name} {metric_type}")
+        lines.extend(name_lines)
+    with open(path, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def write(path):
+    # .prom files get the Prometheus text format, anything else JSON lines
+    if path.endswith(".prom"):
+        write_prometheus(path)
+    else:
+        write_json_lines(path)
@@ -0,0 +1,130 @@
+import datetime
+import numbers
+
+import numpy as np
+import pandas as pd
+
+# Vectorised normalisers, every one takes an object array of values and returns an object array of the same length.
+# Values a normaliser does not understand are returned unchanged, so the comparison still shows them as mismatch.
+
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+# Decimals kept by the float normaliser, smaller differences are treated as equal
+FLOAT_DECIMALS = 6
+
+BOOL_VALUES = {"true": True, "1": True, "yes": True, "false": False, "0": False, "no": False}
+
+
+def is_instance(values, types):
+    return np.fromiter((isinstance(value, types) for value in values), dtype=bool, count=len(values))
+
+
+def format_datetime(value):
+    # A date, datetime or datetime64 as ISO string in UTC, None for NaT
+    if isinstance(value, np.datetime64):
+        value = pd.Timestamp(value)
+    if pd.isna(value):
+        return None
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime(value.year, value.month, value.day)
+    elif value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc)
+    return value.strftime(DATETIME_FORMAT)
+
+
+def normalize_datetime(values):
+    # Dates, datetimes and date strings to ISO strings, time zones are converted to UTC.
+    # Values that already are times (the datetime columns of the DB) are only formatted, strings are parsed.
+    values = values.copy()
+    texts = is_instance(values, str)
+    times = is_instance(values, (datetime.date, np.datetime64))
+    for position in np.flatnonzero(times):
+        formatted = format_datetime(values[position])
+        if formatted is not None:
+            values[position] = formatted
+    if texts.any():
+        parsed = pd.to_datetime(pd.Series(values[texts]), errors='coerce', utc=True, format='ISO8601')
+        valid = parsed.notna().to_numpy()
+        positions = np.flatnonzero(texts)[valid]
+        values[positions] = parsed[valid].dt.strftime(DATETIME_FORMAT).to_numpy(dtype=object)
+    return values
+
+
+def normalize_gender(values):
+    # DB gender code to the label the API uses
+    return np.where(values == 1, "Male", "Female").astype(object)
+
+
+def normalize_bool(values):
+    # True/False, 1/0 and "true"/"false" like strings to bool
+    values = values.copy()
+    numbers_mask = is_instance(values, numbers.Real) & ~pd.isna(values)
+    values[numbers_mask] = values[numbers_mask].astype(float) != 0
+    text = is_instance(values, str)
+    values[text] = [BOOL_VALUES.get(value.strip().lower(), value) for value in values[text]]
+    return values
+
+
+def normalize_int(values):
+    # Numbers and numeric strings to int, "7", 7.0 and 7 become 7
+    values = values.copy()
+    parsed = pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(dtype=float)
+    whole = ~np.isnan(parsed) & (parsed == np.round(parsed)) & ~is_instance(values, bool)
+    values[whole] = parsed[whole].astype(np.int64)
+    return values
+
+
+def normalize_float(values):
+    # Numbers and numeric strings to float rounded to FLOAT_DECIMALS
+    values = values.copy()
+    parsed = pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(dtype=float)
+    valid = ~np.isnan(parsed) & ~is_instance(values, bool)
+    values[valid] = np.round(parsed[valid], FLOAT_DECIMALS)
+    return values
+
+
+def normalize_text(values):
+    # Strings without surrounding white space
+    values = values.copy()
+    text = is_instance(values, str)
+    values[text] = pd.Series(values[text], dtype=object).str.strip().to_numpy(dtype=object)
+    return values
+
+
+def normalize_casefold(values):
+    # Strings without surrounding white space and without case
+    values = normalize_text(values)
+    text = is_instance(values, str)
+    values[text] = pd.Series(values[text], dtype=object).str.casefold().to_numpy(dtype=object)
+    return values
+
+
+def keep(values):
+    return values
+
+
+# Normaliser name: (DB side, API side)
+NORMALIZERS = {
+    "datetime": (normalize_datetime, normalize_datetime),
+    "gender": (normalize_gender, keep),
+    "bool": (normalize_bool, normalize_bool),
+    "int": (normalize_int, normalize_int),
+    "float": (normalize_float, normalize_float),
+    "text": (normalize_text, normalize_text),
+    "casefold": (normalize_casefold, normalize_casefold),
+}
+
+
+def normalize_columns(db_names, db_values, api_values, normalizers):
+    # Normalises the values of every DB column that has a normaliser in normalizers ({DB column: name}),
+    # one call per column for all rows of that column
+    db_values = db_values.copy()
+    api_values = api_values.copy()
+    for db_column_name, normalizer in normalizers.items():
+        rows = db_names == db_column_name
+        if not rows.any():
+            continue
+        normalize_db, normalize_api = NORMALIZERS[normalizer]
+        db_values[rows] = normalize_db(db_values[rows])
+        api_values[rows] = normalize_api(api_values[rows])
+    return db_values, api_values
@@ -0,0 +1,85 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from compare_batch import compare_match_batch, chunk_match_ids
+from result_sink import append_parts, find_part_files, get_part_file, is_dataset_output, merge_summaries
+import metrics
+
+
+def run_shard(environment, match_ids, csv_filename, batch_options, collect_metrics=False):
+    # Runs in a worker process, which has its own DB pool, HTTP session and token.
+    # Returns (failed match ids, metrics samples of this shard or None).
+    if collect_metrics:
+        metrics.reset()
+        metrics.enable(environment)
+    failed_match_ids = compare_match_batch(environment, match_ids, csv_filename, **batch_options)
+    return failed_match_ids, metrics.get_samples() if collect_metrics else None
+
+
+def collect_chunks(futures, done, chunk_failed_match_ids):
+    # Takes the finished futures ({future: chunk index}) out of futures, their failed match ids go to
+    # chunk_failed_match_ids by chunk index
+    for future in done:
+        index = futures.pop(future)
+        chunk_failed_match_ids[index], samples = future.result()
+        if samples is not None:
+            # Worker processes measure on their own, their measurements are added to the ones of this process
+            metrics.merge_samples(samples)
+
+
+def append_finished_parts(output_file, chunk_failed_match_ids, next_index):
+    # Appends the parts of the finished chunks from next_index on, stopping at the first chunk still running,
+    # so the parts end up in chunk order. Returns the index of the next part to append.
+    while next_index in chunk_failed_match_ids:
+        append_parts(output_file, [get_part_file(output_file, next_index)])
+        next_index += 1
+    return next_index
+
+
+def compare_match_parallel(environment, match_ids, csv_filename, workers=None, chunk_size=1000, **batch_options):
+    # compare_match_batch spread over worker processes, batch_options are passed on to compare_match_batch.
+    # match_ids may be a generator, it is read in chunks of chunk_size while the workers run and at most two
+    # chunks per worker wait in the executor, so the match ids are never all in memory.
+    # Returns the failed match ids in the order of match_ids, whatever order the chunks finish in.
+    # With a CSV output_file every chunk writes its own part file, the parts are appended in chunk order
+    # as soon as the chunks before them are done.
+    workers = workers or os.cpu_count() or 1
+    output_file = batch_options.pop("output_file", None)
+    csv_output = output_file and not is_dataset_output(output_file)
+    if csv_output and batch_options.get("journal") is not None:
+        # Parts of a journaled run that died hold checkpointed rows of matches the journal has as done
+        leftover_part_files = find_part_files(output_file)
+        if leftover_part_files:
+            print(f"Appending {len(leftover_part_files)} part files of an earlier run to {output_file}.")
+            append_parts(output_file, leftover_part_files)
+    summary_file = batch_options.pop("summary_file", None)
+    part_summary_files = []
+
+    futures = {}
+    chunk_failed_match_ids = {}
+    next_part_index = 0
+    # spawn instead of fork so no DB connection or HTTP session of this process ends up in a worker
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        for index, chunk in enumerate(chunk_match_ids(match_ids, chunk_size)):
+            # Datasets are written by all workers at the same time, every worker writes its own files
+            part_file = get_part_file(output_file, index) if csv_output else output_file
+            part_summary_file = get_part_file(summary_file, index) if summary_file else None
+            part_summary_files.append(part_summary_file)
+            future = executor.submit(run_shard, environment, chunk, csv_filename,
+                                     dict(batch_options, output_file=part_file, output_header=False,
+                                          summary_file=part_summary_file), metrics.enabled)
+            futures[future] = index
+            if len(futures) >= 2 * workers:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                collect_chunks(futures, done, chunk_failed_match_ids)
+                if csv_output:
+                    next_part_index = append_finished_parts(output_file, chunk_failed_match_ids, next_part_index)
+        done, _ = wait(futures)
+        collect_chunks(futures, done, chunk_failed_match_ids)
+
+    if csv_output:
+        append_finished_parts(output_file, chunk_failed_match_ids, next_part_index)
+    if summary_file:
+        merge_summaries(summary_file, part_summary_files)
+    return [match_id for index in sorted(chunk_failed_match_ids) for match_id in chunk_failed_match_ids[index]]
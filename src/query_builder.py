@@ -0,0 +1,162 @@
+# Builds the DB queries from the mappings, so only the compared columns are fetched.
+# Match level columns come from one row per match, player columns from a second query with one row per player.
+
+# SQL expression per match level DB column, columns that are not listed are taken from MATCHES
+MATCH_COLUMNS = {
+    "START_DATE": "S.START_DATE",
+    "END_DATE": "S.END_DATE",
+    "SEASON_NAME": "S.NAME",
+    "GENDER": "L.GENDER",
+    "AREA_ID": "L.AREA_ID",
+    "LEAGUE_NAME": "L.NAME",
+    "HOME_TEAM_NAME": "TH.NAME",
+    "AWAY_TEAM_NAME": "TA.NAME",
+}
+
+# Join needed for the table alias used in an expression
+MATCH_JOINS = {
+    "S": "JOIN SEASONS S ON M.SEASON_ID = S.SEASON_ID",
+    "L": "JOIN LEAGUES L ON M.LEAGUE_ID = L.LEAGUE_ID",
+    "TH": "JOIN TEAMS TH ON M.HOME_TEAM_ID = TH.TEAM_ID",
+    "TA": "JOIN TEAMS TA ON M.AWAY_TEAM_ID = TA.TEAM_ID",
+}
+
+# Always fetched: MATCH_ID to split batch results per match, LEAGUE_ID to partition the output
+MATCH_KEY_COLUMNS = ["MATCH_ID", "LEAGUE_ID"]
+
+# SQL expression per player DB column, columns that are not listed are taken from MATCH_TEAM_PLAYERS
+PLAYER_COLUMNS = {
+    "IS_HOME": "CASE WHEN MTP.TEAM_ID = M.HOME_TEAM_ID THEN 1 ELSE 0 END",
+}
+
+# Always fetched: MATCH_ID to split batch results per match, IS_HOME to split the teams
+PLAYER_KEY_COLUMNS = ["MATCH_ID", "IS_HOME"]
+
+# Type of the DB columns, used by db_reader to build typed columns without inferring them.
+# Columns that are not listed get the type the driver reports.
+COLUMN_TYPES = {
+    "MATCH_ID": "int",
+    "LEAGUE_ID": "int",
+    "START_DATE": "datetime",
+    "END_DATE": "datetime",
+    "SEASON_NAME": "str",
+    "GENDER": "int",
+    "AREA_ID": "int",
+    "LEAGUE_NAME": "str",
+    "KICKOFF_DATE": "datetime",
+    "HOME_TEAM_ID": "int",
+    "AWAY_TEAM_ID": "int",
+    "HOME_TEAM_NAME": "str",
+    "AWAY_TEAM_NAME": "str",
+    "IS_HOME": "int",
+    "PLAYER_ID": "int",
+    "SHIRT_NUMBER": "int",
+    "MINUTES_PLAYED": "int",
+    "STARTING": "bool",
+    "POSITION_1": "str",
+}
+
+# Filter on a single match, the match id is the only parameter
+MATCH_WHERE = "WHERE M.MATCH_ID = ?"
+
+
+def get_match_expression(db_column_name):
+    return MATCH_COLUMNS.get(db_column_name, f"M.{db_column_name}")
+
+
+def get_player_expression(db_column_name):
+    return PLAYER_COLUMNS.get(db_column_name, f"MTP.{db_column_name}")
+
+
+def select_list(db_column_names, get_expression):
+    lines = []
+    for db_column_name in dict.fromkeys(db_column_names):
+        expression = get_expression(db_column_name)
+        if expression.endswith(f".{db_column_name}"):
+            lines.append(expression)
+        else:
+            lines.append(f"{expression} AS {db_column_name}")
+    return ",\n        ".join(lines)
+
+
+def build_match_query(mappings, match_filter=MATCH_WHERE):
+    # One row per match with the mapped match columns.
+    # match_filter picks the matches, e.g. MATCH_WHERE or a join on a temp table with match ids.
+    db_column_names = MATCH_KEY_COLUMNS + [db_column_name for db_column_name, _ in mappings]
+    expressions = [get_match_expression(db_column_name) for db_column_name in db_column_names]
+    joins = [join for alias, join in MATCH_JOINS.items() if any(expression.startswith(f"{alias}.") for expression in expressions)]
+    return "SELECT " + select_list(db_column_names, get_match_expression) + """
+    FROM MATCHES M
+    """ + "\n    ".join(joins + [match_filter]) + """
+    ORDER BY M.MATCH_ID;
+    """
+
+
+def build_player_query(player_mappings, key_columns=(), match_filter=MATCH_WHERE):
+    # One row per player with the mapped player columns and the columns the players are paired on
+    db_column_names = PLAYER_KEY_COLUMNS + [db_column_name for db_column_name, _ in key_columns] \
+        + [db_column_name for db_column_name, _ in player_mappings]
+    return "SELECT " + select_list(db_column_names, get_player_expression) + """
+    FROM MATCH_TEAM_PLAYERS MTP
+    JOIN MATCHES M ON M.MATCH_ID = MTP.MATCH_ID
+    """ + match_filter + """
+    ORDER BY MTP.MATCH_ID;
+    """
+
+
+def build_checksum_query(match_ids_table):
+    # One row per match id in match_ids_table with a checksum of every row the match and player queries read:
+    # the match, the joined season, league and team rows, and the player rows. A change in any of them, e.g.
+    # a corrected team name, changes the checksums of the match.
+    checksums = ["(SELECT CHECKSUM_AGG(BINARY_CHECKSUM(*)) FROM MATCHES M WHERE M.MATCH_ID = IDS.MATCH_ID) "
+                 "AS MATCH_CHECKSUM"]
+    for alias, join in MATCH_JOINS.items():
+        checksums.append(f"(SELECT CHECKSUM_AGG(BINARY_CHECKSUM(*)) FROM (SELECT {alias}.* FROM MATCHES M {join} "
+                         f"WHERE M.MATCH_ID = IDS.MATCH_ID) J) AS {alias}_CHECKSUM")
+    checksums.append("(SELECT CHECKSUM_AGG(BINARY_CHECKSUM(*)) FROM MATCH_TEAM_PLAYERS MTP "
+                     "WHERE MTP.MATCH_ID = IDS.MATCH_ID) AS PLAYERS_CHECKSUM")
+    return "SELECT IDS.MATCH_ID,\n        " + ",\n        ".join(checksums) + f"""
+    FROM {match_ids_table} IDS;
+    """
+
+
+def build_match_conditions(season_ids=(), league_ids=(), kickoff_from=None, kickoff_to=None):
+    # WHERE conditions on MATCHES M for seasons, leagues and/or a kickoff window [kickoff_from, kickoff_to),
+    # returns (conditions, params)
+    conditions = []
+    params = []
+    for column, values in (("SEASON_ID", season_ids), ("LEAGUE_ID", league_ids)):
+        if values:
+            conditions.append(f"M.{column} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+    if kickoff_from is not None:
+        conditions.append("M.KICKOFF_DATE >= ?")
+        params.append(kickoff_from)
+    if kickoff_to is not None:
+        conditions.append("M.KICKOFF_DATE < ?")
+        params.append(kickoff_to)
+    return conditions, params
+
+
+def build_discovery_query(season_ids=(), league_ids=(), kickoff_from=None, kickoff_to=None, columns=()):
+    # Keyset paginated query of the match ids of seasons, leagues and/or a kickoff window, with the extra
+    # MATCHES columns after the id. Returns (query, filter_params). The parameters of a page are the page size,
+    # the last match id of the previous page (0 for the first) and the filter_params, every page seeks from the
+    # last id on the primary key instead of skipping rows with OFFSET.
+    conditions, filter_params = build_match_conditions(season_ids, league_ids, kickoff_from, kickoff_to)
+    return "SELECT TOP (?) " + ", ".join(["M.MATCH_ID"] + [f"M.{column}" for column in columns]) + """
+    FROM MATCHES M
+    WHERE """ + "\n    AND ".join(["M.MATCH_ID > ?"] + conditions) + """
+    ORDER BY M.MATCH_ID;
+    """, filter_params
+
+
+def build_stratum_query(season_ids=(), league_ids=(), kickoff_from=None, kickoff_to=None):
+    # Number of matches per league and season for the same filters as build_discovery_query,
+    # returns (query, params)
+    conditions, params = build_match_conditions(season_ids, league_ids, kickoff_from, kickoff_to)
+    where = "WHERE " + "\n    AND ".join(conditions) + "\n    " if conditions else ""
+    return """SELECT M.LEAGUE_ID, M.SEASON_ID, COUNT(*) AS MATCH_COUNT
+    FROM MATCHES M
+    """ + where + """GROUP BY M.LEAGUE_ID, M.SEASON_ID;
+    """, params
@@ -0,0 +1,156 @@
+import asyncio
+import datetime
+import email.utils
+import random
+import threading
+import time
+
+import requests
+
+import metrics
+
+# Seconds to wait for a connection and for the next bytes of a response, so one hung socket cannot stall a run
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+
+# Responses worth trying again, anything else is a final answer
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Longest Retry-After that is honoured, some servers send hours
+MAX_RETRY_AFTER = 300
+
+
+def get_backoff_delay(attempt, backoff=2.0, max_backoff=300.0):
+    # Exponential backoff with full jitter, attempt starts at 1
+    return random.uniform(0, min(max_backoff, backoff * 2 ** (attempt - 1)))
+
+
+def parse_retry_after(value):
+    # Retry-After header in seconds or as HTTP date, returns seconds or None
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return min(float(value), MAX_RETRY_AFTER)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    seconds = (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER)
+
+
+class RetryPolicy:
+    # How often and how long to wait between attempts, a Retry-After of the server wins over the backoff
+    def __init__(self, max_attempts=4, backoff=0.5, max_backoff=30.0):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def get_delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return retry_after
+        return get_backoff_delay(attempt, self.backoff, self.max_backoff)
+
+
+class CircuitBreaker:
+    # Opens after failure_threshold failures in a row: every caller then waits until reset_timeout seconds have
+    # passed, after which one trial call is let through. A success closes the breaker, a failure opens it again.
+    # Safe to use from threads and, with wait_async, from async tasks.
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    def get_wait(self):
+        # Seconds to wait before a call may go out, 0 when it may go out now
+        with self.lock:
+            if self.opened_at is None:
+                return 0.0
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0:
+                return remaining
+            if not self.trial_running:
+                self.trial_running = True
+                return 0.0
+            # Another caller runs the trial call, check again soon
+            return min(1.0, self.reset_timeout)
+
+    def wait(self):
+        while True:
+            seconds = self.get_wait()
+            if seconds <= 0:
+                return
+            time.sleep(seconds)
+
+    async def wait_async(self):
+        while True:
+            seconds = self.get_wait()
+            if seconds <= 0:
+                return
+            await asyncio.sleep(seconds)
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                print(f"{self.name} is back, closing the circuit breaker.")
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or (self.opened_at is None and self.failures >= self.failure_threshold):
+                print(f"{self.name} failed {self.failures} times in a row, pausing calls for {self.reset_timeout} seconds.")
+                metrics.count("circuit_opened")
+                self.opened_at = time.monotonic()
+                self.trial_running = False
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    # One circuit breaker per remote service (e.g. "api" or "identity") for the whole process
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def request_with_retry(send, policy=None, breaker=None, name="Request"):
+    # Calls send(), which does one request with requests and returns the response, until it gets a response
+    # that is not in RETRY_STATUSES or the attempts of policy are used up. Connection errors and timeouts are
+    # retried too, the last one is raised. Returns the last response.
+    policy = policy or RetryPolicy()
+    for attempt in range(1, policy.max_attempts + 1):
+        if breaker is not None:
+            breaker.wait()
+        try:
+            response = send()
+        except requests.RequestException as e:
+            if breaker is not None:
+                breaker.record_failure()
+            if attempt == policy.max_attempts:
+                raise
+            delay = policy.get_delay(attempt)
+            print(f"{name} failed ({e!r}), trying again in {delay:.1f} seconds.")
+        else:
+            if response.status_code not in RETRY_STATUSES:
+                if breaker is not None:
+                    breaker.record_success()
+                return response
+            if breaker is not None:
+                breaker.record_failure()
+            if attempt == policy.max_attempts:
+                return response
+            delay = policy.get_delay(attempt, parse_retry_after(response.headers.get("Retry-After")))
+            print(f"{name} answered {response.status_code}, trying again in {delay:.1f} seconds.")
+            response.close()
+        metrics.count("retries")
+        time.sleep(delay)
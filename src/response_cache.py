@@ -0,0 +1,127 @@
+import gzip
+import json
+import os
+import time
+import uuid
+
+import metrics
+
+# Eviction removes responses until the cache is below this share of max_bytes, so it does not run on every put
+LOW_WATER_MARK = 0.9
+
+
+class ResponseCache:
+    # API responses on disk, one gzipped JSON file per environment and match: <directory>/<environment>/<match_id>.json.gz
+    # ttl is the age in seconds after which a response is fetched again, None keeps responses forever.
+    # max_bytes limits the size of the cache, the least recently used responses are removed first.
+    # The size is scanned once per process and then kept up to date with the own puts, the directory is only
+    # walked again when that total goes over max_bytes. Puts of other processes are found by that walk.
+    # offline replays the stored responses only, the API is never called and the ttl is ignored.
+    # Only settings are stored on the object, so it can be passed to worker processes.
+    def __init__(self, directory, ttl=None, max_bytes=None, offline=False):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.size = None
+
+    def get_path(self, environment, match_id):
+        return os.path.join(self.directory, environment, f"{match_id}.json.gz")
+
+    def get(self, environment, match_id):
+        # Returns the stored API data, or None when the match is not stored or the response expired
+        path = self.get_path(environment, match_id)
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Ignoring broken cache file {path}: {e}")
+            return None
+        if not self.offline and self.ttl is not None and time.time() - entry["stored_at"] > self.ttl:
+            return None
+        # The modification time is the last use, eviction removes the oldest first
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry["data"]
+
+    def put(self, environment, match_id, api_data):
+        path = self.get_path(environment, match_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written under a temporary name first, so other processes never read half a file
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump({"stored_at": time.time(), "data": api_data}, f)
+        if self.max_bytes is None:
+            os.replace(tmp_path, path)
+            return
+        if self.size is None:
+            self.size = sum(size for _, size, _ in self.get_files())
+        try:
+            replaced_size = os.path.getsize(path)
+        except FileNotFoundError:
+            replaced_size = 0
+        self.size += os.path.getsize(tmp_path) - replaced_size
+        os.replace(tmp_path, path)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def get_files(self):
+        # [(last use, size, path)] of the stored responses
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(".json.gz"):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def evict(self):
+        # Removes the least recently used responses until the cache is below LOW_WATER_MARK of max_bytes
+        files = self.get_files()
+        total = sum(size for _, size, _ in files)
+        target = self.max_bytes * LOW_WATER_MARK
+        for _, size, path in sorted(files):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self.size = total
+
+
+def fetch_with_cache(cache, environment, match_ids, fetch, etags=None):
+    # Like fetch(match_ids, etags) ({match_id: api_data}), but stored responses are taken from the cache
+    # and only the other matches are fetched. New responses are stored in the cache.
+    if cache is None:
+        return fetch(match_ids, etags)
+    api_data = {}
+    missing = []
+    for match_id in match_ids:
+        api_data[match_id] = cache.get(environment, match_id)
+        if api_data[match_id] is None:
+            missing.append(match_id)
+    metrics.count("cache_hits", len(match_ids) - len(missing))
+    metrics.count("cache_misses", len(missing))
+    if not missing:
+        return api_data
+    if cache.offline:
+        print(f"{len(missing)} matches are not in the response cache: {missing}")
+        return api_data
+
+    fetched = fetch(missing, etags)
+    for match_id, data in fetched.items():
+        # None and NOT_MODIFIED are no responses to replay
+        if isinstance(data, dict):
+            cache.put(environment, match_id, data)
+    api_data.update(fetched)
+    return api_data
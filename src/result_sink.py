@@ -0,0 +1,434 @@
+import csv
+import datetime
+import gzip
+import io
+import os
+import re
+import uuid
+
+import numpy as np
+import pandas as pd
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pa = None
+
+from compare_engine import COMPARISON_COLUMNS, to_object_array, is_number
+
+
+class ResultSink:
+    # Receives the comparison frame of every match as soon as it is ready, league is the LEAGUE_ID of the match
+    def write(self, match_id, comparison_df, league=None):
+        raise NotImplementedError
+
+    def checkpoint(self):
+        # Makes sure everything written so far ends up in the output, also when the process dies afterwards.
+        # Once a sink was checkpointed only checkpointed rows are kept: close drops the rows written after the
+        # last checkpoint, and a process that dies leaves them behind in a form the next run drops too.
+        # Callers that journal their progress (see job_runner) checkpoint right after opening the sink.
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class CsvFilesSink(ResultSink):
+    # One CSV file per match, csv_filename is the prefix, the match id and .csv are added per match
+    def __init__(self, csv_filename):
+        self.csv_filename = csv_filename
+
+    def write(self, match_id, comparison_df, league=None):
+        comparison_df.to_csv(self.csv_filename + str(match_id) + ".csv", index=False)
+
+
+def get_commit_file(path):
+    # Holds the size of path at its last checkpoint
+    return path + ".committed"
+
+
+def commit_file_size(path):
+    # Makes path durable and stores its size as the committed size, the size is replaced atomically
+    with open(path, "rb") as f:
+        os.fsync(f.fileno())
+    size = os.path.getsize(path)
+    commit_file = get_commit_file(path)
+    with open(commit_file + ".tmp", "w") as f:
+        f.write(str(size))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(commit_file + ".tmp", commit_file)
+
+
+def truncate_to_committed(path, remove_commit_file=False):
+    # Drops what was written to path after its last checkpoint, e.g. by a process that died in the middle of a chunk.
+    # For compressed files that is the unfinished member, the committed ones stay readable.
+    commit_file = get_commit_file(path)
+    if not os.path.exists(commit_file):
+        return
+    with open(commit_file) as f:
+        size = int(f.read())
+    if os.path.exists(path) and os.path.getsize(path) > size:
+        print(f"Dropping {os.path.getsize(path) - size} bytes written after the last checkpoint of {path}.")
+        with open(path, "r+b") as f:
+            f.truncate(size)
+    if remove_commit_file:
+        os.remove(commit_file)
+
+
+def open_binary(path, mode):
+    # mode is "wb" or "ab", the compression follows the file extension
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise ImportError("zstandard is needed to write .zst files, pip install zstandard")
+        return zstandard.ZstdCompressor().stream_writer(open(path, mode))
+    return open(path, mode)
+
+
+class CsvSink(ResultSink):
+    # Appends the rows of all matches to one CSV file (.csv, .csv.gz or .csv.zst) with a Match ID column.
+    # Only one match is in memory at a time. The header is written when the file is new and header is True.
+    # A checkpoint ends the compressed member and stores the committed size next to the file (<path>.committed),
+    # rows after it are cut off again by close or, after a crash, when the file is opened by the next run.
+    def __init__(self, path, header=True):
+        self.path = path
+        # The commit file of a run that died is done with once the file is cut back, a checkpoint writes a new one
+        truncate_to_committed(path, remove_commit_file=True)
+        self.header = header and (not os.path.exists(path) or os.path.getsize(path) == 0)
+        self.handle = self.open_handle()
+        self.checkpointed = False
+
+    def open_handle(self):
+        return io.TextIOWrapper(open_binary(self.path, "ab"), encoding="utf-8", newline="")
+
+    def write_header(self):
+        if self.header:
+            csv.writer(self.handle).writerow(['Match ID'] + COMPARISON_COLUMNS)
+            self.header = False
+
+    def write(self, match_id, comparison_df, league=None):
+        comparison_df = comparison_df.copy()
+        comparison_df.insert(0, 'Match ID', match_id)
+        comparison_df.to_csv(self.handle, header=self.header, index=False)
+        self.header = False
+
+    def checkpoint(self):
+        # Closing finishes the gzip or zstd member, so the committed part of the file is complete on its own
+        self.handle.close()
+        commit_file_size(self.path)
+        self.checkpointed = True
+        self.handle = self.open_handle()
+
+    def close(self):
+        self.handle.close()
+        if self.checkpointed:
+            truncate_to_committed(self.path, remove_commit_file=True)
+
+
+# Timestamps in the value columns are written as ISO strings, e.g. 2021-06-20T16:00:00
+ISO_DATE_PATTERN = r"^\d{4}-\d{2}-\d{2}([T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?$"
+
+
+def split_typed_values(values, prefix):
+    # Splits a mixed object column into a number, a text and a timestamp column, only one of them is set per row
+    values = to_object_array(values)
+    numbers = is_number(values)
+    timestamps = np.fromiter((isinstance(value, (datetime.date, np.datetime64)) for value in values),
+                             dtype=bool, count=len(values))
+    texts = ~numbers & ~timestamps & ~pd.isna(values)
+
+    text_values = np.full(len(values), None, dtype=object)
+    text_values[texts] = values[texts].astype(str)
+    iso_dates = texts & pd.Series(text_values).str.match(ISO_DATE_PATTERN, na=False).to_numpy()
+    texts &= ~iso_dates
+    text_values[~texts] = None
+
+    timestamp_values = np.full(len(values), np.datetime64("NaT"), dtype="datetime64[us]")
+    if timestamps.any():
+        timestamp_values[timestamps] = pd.to_datetime(pd.Series(values[timestamps]), errors='coerce').to_numpy()
+    if iso_dates.any():
+        timestamp_values[iso_dates] = pd.to_datetime(pd.Series(values[iso_dates].astype(str)), format='ISO8601',
+                                                     errors='coerce').to_numpy()
+
+    number_values = np.full(len(values), np.nan)
+    if numbers.any():
+        number_values[numbers] = values[numbers].astype(float)
+
+    return {
+        f"{prefix}_NUMBER": number_values,
+        f"{prefix}_TEXT": text_values,
+        f"{prefix}_TIMESTAMP": timestamp_values,
+    }
+
+
+if pa is not None:
+    DATASET_SCHEMA = pa.schema([
+        ("MATCH_ID", pa.int64()),
+        ("DB_COLUMN_NAME", pa.string()),
+        ("API_NAME", pa.string()),
+        ("DB_NUMBER", pa.float64()),
+        ("DB_TEXT", pa.string()),
+        ("DB_TIMESTAMP", pa.timestamp("us")),
+        ("API_NUMBER", pa.float64()),
+        ("API_TEXT", pa.string()),
+        ("API_TIMESTAMP", pa.timestamp("us")),
+        ("MATCH", pa.bool_()),
+    ])
+
+
+class DatasetSink(ResultSink):
+    # Typed Parquet or Arrow IPC dataset partitioned as run_date=.../environment=.../league=.../part-*.parquet.
+    # Rows are buffered per partition and written as a row group every flush_rows rows.
+    # Several processes can write into the same dataset, every writer has its own file names.
+    # Files are written under a hidden temporary name (ignored by dataset readers) and renamed when complete,
+    # so a process that dies never leaves a file without footer in the dataset.
+    def __init__(self, path, environment, run_date=None, file_format="parquet", flush_rows=100000):
+        if pa is None:
+            raise ImportError("pyarrow is needed to write Parquet or Arrow output, pip install pyarrow")
+        self.path = path
+        self.environment = environment
+        self.run_date = run_date or datetime.date.today().isoformat()
+        self.file_format = file_format
+        self.flush_rows = flush_rows
+        self.buffers = {}
+        self.writers = {}
+        self.file_id = f"{os.getpid()}-{uuid.uuid4().hex}"
+        self.file_number = 0
+        self.checkpointed = False
+
+    def write(self, match_id, comparison_df, league=None):
+        frame = {
+            "MATCH_ID": np.full(len(comparison_df), int(match_id), dtype=np.int64),
+            "DB_COLUMN_NAME": comparison_df['DB Column Name'].astype(str).to_numpy(),
+            "API_NAME": comparison_df['API Name'].astype(str).to_numpy(),
+        }
+        frame.update(split_typed_values(comparison_df['DB Value'], "DB"))
+        frame.update(split_typed_values(comparison_df['API Value'], "API"))
+        frame["MATCH"] = comparison_df['Match'].to_numpy(dtype=bool)
+
+        buffer = self.buffers.setdefault(league, [])
+        buffer.append(pa.Table.from_pydict(frame, schema=DATASET_SCHEMA))
+        if sum(table.num_rows for table in buffer) >= self.flush_rows:
+            self.flush(league)
+
+    def get_writer(self, league):
+        if league not in self.writers:
+            directory = os.path.join(self.path, f"run_date={self.run_date}", f"environment={self.environment}",
+                                     f"league={league}")
+            os.makedirs(directory, exist_ok=True)
+            file_name = f"part-{self.file_id}-{self.file_number}.{self.file_format}"
+            file_path = os.path.join(directory, file_name)
+            tmp_path = os.path.join(directory, f".{file_name}.tmp")
+            if self.file_format == "parquet":
+                writer = pa.parquet.ParquetWriter(tmp_path, DATASET_SCHEMA)
+            else:
+                writer = pa.ipc.new_file(tmp_path, DATASET_SCHEMA)
+            self.writers[league] = (writer, tmp_path, file_path)
+        return self.writers[league][0]
+
+    def flush(self, league):
+        buffer = self.buffers.pop(league, [])
+        if buffer:
+            self.get_writer(league).write_table(pa.concat_tables(buffer))
+
+    def close_files(self, keep):
+        # keep renames the files to their final names, otherwise they are removed
+        for writer, tmp_path, file_path in self.writers.values():
+            writer.close()
+            if keep:
+                os.replace(tmp_path, file_path)
+            else:
+                os.remove(tmp_path)
+        self.writers = {}
+
+    def checkpoint(self):
+        # Parquet and Arrow files are only readable once closed, the next rows go to new files
+        for league in list(self.buffers):
+            self.flush(league)
+        self.close_files(keep=True)
+        self.file_number += 1
+        self.checkpointed = True
+
+    def close(self):
+        if self.checkpointed:
+            # Rows after the last checkpoint belong to matches that are not journaled as done
+            self.buffers = {}
+            self.close_files(keep=False)
+            return
+        for league in list(self.buffers):
+            self.flush(league)
+        self.close_files(keep=True)
+
+
+SUMMARY_COLUMNS = ['Total', 'Matched', 'Mismatched', 'Missing']
+
+
+class SummarySink(ResultSink):
+    # Counts total, matched, mismatched and missing (None/NaN on either side) fields per match and per mapping
+    # (DB Column Name) while the matches come in, and passes the rows on to sink, only the mismatches when
+    # mismatches_only is True. The per match counts are appended to <summary_file>_matches.csv right away,
+    # the per mapping counts are written to <summary_file>_mappings.csv on close.
+    # Checkpoints work like the ones of CsvSink, after one only the checkpointed matches are counted.
+    def __init__(self, sink, summary_file=None, mismatches_only=False):
+        self.sink = sink
+        self.summary_file = summary_file
+        self.mismatches_only = mismatches_only
+        self.mapping_counts = {}
+        self.totals = np.zeros(4, dtype=np.int64)
+        self.committed = None
+        self.match_file = None
+        if summary_file is not None:
+            match_file_name = summary_file + "_matches.csv"
+            truncate_to_committed(match_file_name, remove_commit_file=True)
+            header = not os.path.exists(match_file_name) or os.path.getsize(match_file_name) == 0
+            self.match_file = open(match_file_name, "a", newline="")
+            self.match_writer = csv.writer(self.match_file)
+            if header:
+                self.match_writer.writerow(['Match ID', 'League'] + SUMMARY_COLUMNS)
+
+    def write(self, match_id, comparison_df, league=None):
+        matched = comparison_df['Match'].to_numpy(dtype=bool)
+        missing = pd.isna(comparison_df['DB Value'].to_numpy()) | pd.isna(comparison_df['API Value'].to_numpy())
+        counts = pd.DataFrame({
+            'DB Column Name': comparison_df['DB Column Name'].to_numpy(),
+            'Total': 1,
+            'Matched': matched.astype(np.int64),
+            'Mismatched': (~matched).astype(np.int64),
+            'Missing': missing.astype(np.int64),
+        }).groupby('DB Column Name', sort=False).sum()
+
+        for db_column_name, row in zip(counts.index, counts.to_numpy()):
+            if db_column_name in self.mapping_counts:
+                self.mapping_counts[db_column_name] += row
+            else:
+                self.mapping_counts[db_column_name] = row.copy()
+        match_totals = counts.to_numpy().sum(axis=0)
+        self.totals += match_totals
+        if self.match_file is not None:
+            self.match_writer.writerow([match_id, league] + [int(count) for count in match_totals])
+
+        if self.mismatches_only:
+            comparison_df = comparison_df[~matched]
+            if comparison_df.empty:
+                return
+        self.sink.write(match_id, comparison_df, league)
+
+    def checkpoint(self):
+        self.sink.checkpoint()
+        if self.match_file is not None:
+            self.match_file.flush()
+            commit_file_size(self.match_file.name)
+        self.committed = ({name: counts.copy() for name, counts in self.mapping_counts.items()}, self.totals.copy())
+
+    def close(self):
+        self.sink.close()
+        if self.committed is not None:
+            self.mapping_counts, self.totals = self.committed
+        if self.match_file is not None:
+            self.match_file.close()
+            if self.committed is not None:
+                truncate_to_committed(self.match_file.name, remove_commit_file=True)
+            write_mapping_summary(self.summary_file + "_mappings.csv", self.mapping_counts)
+        total, matched, mismatched, missing = (int(count) for count in self.totals)
+        print(f"Compared {total} fields: {matched} matched, {mismatched} mismatched, {missing} missing.")
+
+
+def write_mapping_summary(file_name, mapping_counts):
+    with open(file_name, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(['DB Column Name'] + SUMMARY_COLUMNS)
+        for db_column_name, counts in mapping_counts.items():
+            writer.writerow([db_column_name] + [int(count) for count in counts])
+
+
+def merge_summaries(summary_file, part_summary_files):
+    # Combines the summaries written by parallel workers in the given order and removes the parts
+    match_parts = [part + "_matches.csv" for part in part_summary_files if os.path.exists(part + "_matches.csv")]
+    mapping_parts = [part + "_mappings.csv" for part in part_summary_files if os.path.exists(part + "_mappings.csv")]
+
+    match_file_name = summary_file + "_matches.csv"
+    header = not os.path.exists(match_file_name) or os.path.getsize(match_file_name) == 0
+    for part in match_parts:
+        pd.read_csv(part).to_csv(match_file_name, mode="a", header=header, index=False)
+        header = False
+        os.remove(part)
+
+    mapping_counts = {}
+    for part in mapping_parts:
+        for row in pd.read_csv(part).itertuples(index=False):
+            counts = np.array(row[1:], dtype=np.int64)
+            mapping_counts[row[0]] = mapping_counts[row[0]] + counts if row[0] in mapping_counts else counts
+        os.remove(part)
+    write_mapping_summary(summary_file + "_mappings.csv", mapping_counts)
+
+
+def is_dataset_output(output_file):
+    return output_file is not None and output_file.rstrip("/").endswith((".parquet", ".arrow"))
+
+
+def open_sink(output_file=None, csv_filename=None, header=True, environment=None, summary_file=None,
+              mismatches_only=False):
+    # output_file decides the format: a directory ending in .parquet or .arrow gets a partitioned dataset,
+    # anything else one CSV file. Without an output_file every match gets its own CSV file.
+    # With a summary_file or mismatches_only the sink is wrapped in a SummarySink.
+    if output_file is None:
+        sink = CsvFilesSink(csv_filename)
+    elif is_dataset_output(output_file):
+        sink = DatasetSink(output_file, environment, file_format=output_file.rstrip("/").rsplit(".", 1)[1])
+    else:
+        sink = CsvSink(output_file, header)
+    if summary_file is not None or mismatches_only:
+        sink = SummarySink(sink, summary_file, mismatches_only)
+    return sink
+
+
+def get_part_file(output_file, index):
+    # Same extension as output_file, so the part gets the same compression
+    directory, name = os.path.split(output_file)
+    return os.path.join(directory, f"part{index}.{name}")
+
+
+def find_part_files(output_file):
+    # The part files of get_part_file that exist for output_file, in index order
+    directory, name = os.path.split(output_file)
+    pattern = re.compile(r"part(\d+)\." + re.escape(name) + "$")
+    found = [(int(match.group(1)), file_name) for file_name in os.listdir(directory or ".")
+             for match in [pattern.match(file_name)] if match]
+    return [os.path.join(directory, file_name) for _, file_name in sorted(found)]
+
+
+def append_parts(output_file, part_files):
+    # Appends the part files, written with header=False, to output_file in the given order and removes them.
+    # Compressed parts can be appended as they are, gzip and zstd files may hold several members.
+    # Parts left behind by a process that died are cut back to their last checkpoint first.
+    # Only a new file gets the header, so appending part by part adds no empty compressed members
+    if not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
+        with CsvSink(output_file) as sink:
+            sink.write_header()
+    with open(output_file, "ab") as output:
+        for part_file in part_files:
+            if not os.path.exists(part_file):
+                continue
+            truncate_to_committed(part_file, remove_commit_file=True)
+            with open(part_file, "rb") as part:
+                while True:
+                    block = part.read(1024 * 1024)
+                    if not block:
+                        break
+                    output.write(block)
+            os.remove(part_file)
@@ -0,0 +1,62 @@
+import datetime
+import hashlib
+import json
+import sqlite3
+
+
+class StateStore:
+    # Local SQLite file with, per environment and match, what the sources looked like at the last comparison
+    def __init__(self, path):
+        # Parallel runs write to the same file, wait for the lock instead of failing
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS MATCH_STATE (
+            ENVIRONMENT TEXT NOT NULL,
+            MATCH_ID INTEGER NOT NULL,
+            DB_CHECKSUM TEXT,
+            DB_HASH TEXT,
+            API_ETAG TEXT,
+            API_HASH TEXT,
+            TOTAL INTEGER,
+            MISMATCHES INTEGER,
+            COMPARED_AT TEXT,
+            PRIMARY KEY (ENVIRONMENT, MATCH_ID))""")
+        self.conn.commit()
+
+    def get_states(self, environment, match_ids):
+        # Returns {match_id: state dict} for the matches that were compared before
+        states = {}
+        match_ids = list(match_ids)
+        # SQLite allows a limited number of parameters per query
+        for start in range(0, len(match_ids), 500):
+            part = match_ids[start:start + 500]
+            cursor = self.conn.execute(
+                f"SELECT * FROM MATCH_STATE WHERE ENVIRONMENT = ? AND MATCH_ID IN ({','.join('?' * len(part))})",
+                [environment] + part)
+            columns = [column[0] for column in cursor.description]
+            for row in cursor:
+                state = dict(zip(columns, row))
+                states[state["MATCH_ID"]] = state
+        return states
+
+    def save_state(self, environment, match_id, db_checksum, db_hash, api_etag, api_hash, total, mismatches):
+        self.conn.execute("""INSERT OR REPLACE INTO MATCH_STATE
+            (ENVIRONMENT, MATCH_ID, DB_CHECKSUM, DB_HASH, API_ETAG, API_HASH, TOTAL, MISMATCHES, COMPARED_AT)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                          (environment, match_id, db_checksum, db_hash, api_etag, api_hash, total, mismatches,
+                           datetime.datetime.now().isoformat(timespec='seconds')))
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+def hash_api_data(api_data):
+    return hashlib.sha256(json.dumps(api_data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def hash_db_data(db_data, db_players):
+    content = json.dumps(db_data, sort_keys=True, default=str) + db_players.to_csv(index=False)
+    return hashlib.sha256(content.encode()).hexdigest()
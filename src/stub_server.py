@@ -0,0 +1,90 @@
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the identity server and the matches endpoint of the API, used by the benchmark and the tests
+
+
+class StubHttpServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connections when the async fetcher opens all of them at once,
+    # the client then waits a second for the SYN retransmit
+    request_queue_size = 128
+
+
+class StubApiServer:
+    # Local HTTP server with a token endpoint and the matches endpoint, api_latency adds a delay in seconds
+    # to every match request to mimic the network.
+    # failures ({match_id: [status, ...]}) are answered, one per request, before the match data is; a 429 comes
+    # with Retry-After: 0. Every token request gets a new token (token-1, token-2, ...) and a match request with
+    # an older token is answered 401, unless token_status says the identity server rejects every token request.
+    # token_requests and match_requests count the requests.
+    def __init__(self, api_data, api_latency=0.0, failures=None, expires_in=3600, token_status=200):
+        api_responses = {match_id: json.dumps(data).encode() for match_id, data in api_data.items()}
+        self.failures = {match_id: list(statuses) for match_id, statuses in (failures or {}).items()}
+        self.token_requests = 0
+        self.match_requests = 0
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out as separate writes, with Nagle on every response waits for the delayed ACK
+            disable_nagle_algorithm = True
+
+            def send_json(self, status, body, headers=()):
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with stub.lock:
+                    stub.token_requests += 1
+                    token = f"token-{stub.token_requests}"
+                if token_status != 200:
+                    self.send_json(token_status, json.dumps({"error": "invalid_grant"}).encode())
+                    return
+                self.send_json(200, json.dumps({"access_token": token, "expires_in": expires_in}).encode())
+
+            def do_GET(self):
+                found = re.fullmatch(r"/api/v1/wyscout/matches/(\d+)", self.path)
+                if not found or int(found.group(1)) not in api_responses:
+                    self.send_json(404, b"{}")
+                    return
+                match_id = int(found.group(1))
+                with stub.lock:
+                    stub.match_requests += 1
+                    current_token = f"Bearer token-{stub.token_requests}"
+                    statuses = stub.failures.get(match_id)
+                    status = statuses.pop(0) if statuses else None
+                if api_latency:
+                    time.sleep(api_latency)
+                if status is None and self.headers.get("Authorization") != current_token:
+                    status = 401
+                if status is not None:
+                    self.send_json(status, b"{}", [("Retry-After", "0")] if status == 429 else ())
+                    return
+                self.send_json(200, api_responses[match_id])
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = StubHttpServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        # A short poll interval so shutdown does not wait half a second
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.server.shutdown()
+        self.server.server_close()
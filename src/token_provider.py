@@ -0,0 +1,160 @@
+import asyncio
+import json
+import threading
+import time
+
+import requests
+
+import metrics
+from resilience import request_with_retry, get_breaker, CONNECT_TIMEOUT, READ_TIMEOUT
+
+
+# Credentials file and identity server per environment
+TOKEN_SETTINGS = {
+    'prod': ("../properties/api_credentials_prod.json", "https://identity.scisports.app/connect/token"),
+    'test': ("../properties/api_credentials.json", "https://identity-test.scisports.app/connect/token"),
+}
+
+# Used when the identity server does not send expires_in
+DEFAULT_EXPIRES_IN = 300
+
+# Seconds a failed token request is remembered, so callers do not all ask the identity server again
+FAILURE_BACKOFF = 60
+
+
+class TokenError(requests.RequestException):
+    # No access token could be obtained
+    pass
+
+
+class TokenProvider:
+    # Caches the access token and refreshes it refresh_margin seconds before it expires.
+    # get_token is safe to call from several threads, get_token_async from async tasks.
+    # When no token can be obtained get_token raises TokenError, for failure_backoff seconds without asking the
+    # identity server again, so a rejected password does not turn into one password grant per match.
+    def __init__(self, properties_file_path, token_url, refresh_margin=60, failure_backoff=FAILURE_BACKOFF):
+        self.properties_file_path = properties_file_path
+        self.token_url = token_url
+        self.refresh_margin = refresh_margin
+        self.failure_backoff = failure_backoff
+        self.failure = None
+        self.failed_until = 0.0
+        self.properties = None
+        self.access_token = None
+        self.refresh_token = None
+        self.expires_at = 0.0
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+
+    def get_properties(self):
+        if self.properties is None:
+            with open(self.properties_file_path) as f:
+                self.properties = json.load(f)
+        return self.properties
+
+    def is_valid(self):
+        return self.access_token is not None and time.monotonic() < self.expires_at - self.refresh_margin
+
+    def request_token(self, data):
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        metrics.count("token_requests")
+        with metrics.timer("identity"):
+            response = request_with_retry(
+                lambda: self.session.post(self.token_url, data=data, headers=headers,
+                                          timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)),
+                breaker=get_breaker("identity"), name="Token request")
+            if 400 <= response.status_code < 500:
+                # Rejected credentials are a failure of the identity calls, not an answer to pass on
+                get_breaker("identity").record_failure()
+            with response:
+                response.raise_for_status()
+                json_data = response.json()
+
+        self.access_token = json_data["access_token"]
+        self.refresh_token = json_data.get("refresh_token", self.refresh_token)
+        self.expires_at = time.monotonic() + float(json_data.get("expires_in") or DEFAULT_EXPIRES_IN)
+
+    def password_grant(self):
+        prop = self.get_properties()
+        self.request_token({
+            "grant_type": prop.get("grant_type"),
+            "username": prop.get("username"),
+            "password": prop.get("password"),
+            "client_id": prop.get("client_id"),
+            "client_secret": prop.get("client_secret"),
+            "scope": prop.get("scope")
+        })
+
+    def refresh_grant(self):
+        prop = self.get_properties()
+        self.request_token({
+            "grant_type": "refresh_token",
+            "refresh_token": self.refresh_token,
+            "client_id": prop.get("client_id"),
+            "client_secret": prop.get("client_secret"),
+        })
+
+    def get_token(self):
+        if self.is_valid():
+            return self.access_token
+        with self.lock:
+            # Another thread may have refreshed the token while we waited for the lock
+            if self.is_valid():
+                return self.access_token
+            if time.monotonic() < self.failed_until:
+                raise TokenError(f"No access token, the last token request failed: {self.failure!r}")
+            try:
+                self.request_new_token()
+            except requests.RequestException as e:
+                self.failure = e
+                self.failed_until = time.monotonic() + self.failure_backoff
+                raise TokenError(f"No access token: {e!r}") from e
+            self.failure = None
+            return self.access_token
+
+    def request_new_token(self):
+        if self.refresh_token:
+            try:
+                self.refresh_grant()
+                return
+            except requests.RequestException as e:
+                print(f"Refreshing access token failed, requesting a new one: {e}")
+                self.refresh_token = None
+        self.password_grant()
+
+    async def get_token_async(self):
+        if self.is_valid():
+            return self.access_token
+        if time.monotonic() < self.failed_until:
+            raise TokenError(f"No access token, the last token request failed: {self.failure!r}")
+        # The identity request is blocking, keep it off the event loop
+        return await asyncio.to_thread(self.get_token)
+
+    def invalidate(self):
+        # Force a refresh on the next get_token, e.g. after a 401 from the API
+        with self.lock:
+            self.expires_at = 0.0
+
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def set_token_provider(environment, provider):
+    # Replaces the provider of an environment, e.g. with one for a local identity server.
+    # Returns the provider it replaced (None when there was none) so it can be put back, None removes the provider.
+    environment = 'prod' if environment == 'prod' else 'test'
+    with _providers_lock:
+        previous = _providers.pop(environment, None)
+        if provider is not None:
+            _providers[environment] = provider
+        return previous
+
+
+def get_token_provider(environment):
+    # One TokenProvider per environment for the whole process
+    environment = 'prod' if environment == 'prod' else 'test'
+    with _providers_lock:
+        if environment not in _providers:
+            _providers[environment] = TokenProvider(*TOKEN_SETTINGS[environment])
+        return _providers[environment]
@@ -0,0 +1,53 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "src"))
+
+import resilience
+from stub_server import StubApiServer
+from token_provider import TokenProvider
+
+API_DATA = {
+    1: {"id": 1, "homeTeam": {"name": "Home"}, "awayTeam": {"name": "Away"}},
+    2: {"id": 2, "homeTeam": {"name": "Home"}, "awayTeam": {"name": "Away"}},
+}
+
+
+@pytest.fixture(autouse=True)
+def breakers():
+    # The circuit breakers are shared by the whole process, every test starts with closed ones
+    resilience._breakers.clear()
+    yield
+    resilience._breakers.clear()
+
+
+@pytest.fixture
+def credentials_file(tmp_path):
+    path = tmp_path / "api_credentials.json"
+    path.write_text(json.dumps({"grant_type": "password", "client_id": "test"}))
+    return str(path)
+
+
+@pytest.fixture
+def make_server():
+    # Starts a StubApiServer with API_DATA, make_server(failures={1: [503]}) answers match 1 once with 503
+    servers = []
+
+    def make(**kwargs):
+        server = StubApiServer(API_DATA, **kwargs).__enter__()
+        servers.append(server)
+        return server
+
+    yield make
+    for server in servers:
+        server.__exit__(None, None, None)
+
+
+@pytest.fixture
+def make_token_provider(credentials_file):
+    def make(server, **kwargs):
+        return TokenProvider(credentials_file, f"{server.base_url}/connect/token", **kwargs)
+    return make
@@ -0,0 +1,66 @@
+from adaptive_limit import AdaptiveLimit, MIN_WINDOW
+
+
+def run_window(limit, count, latency=0.01, failed=0):
+    # count requests that all run at the same time, the first failed of them fail
+    for _ in range(count):
+        assert limit.try_acquire()
+    for index in range(count):
+        limit.release(latency, failed=index < failed)
+
+
+def test_try_acquire_respects_the_limit():
+    limit = AdaptiveLimit("test", initial_limit=2, min_limit=1, max_limit=10)
+    assert limit.try_acquire()
+    assert limit.try_acquire()
+    assert not limit.try_acquire()
+    limit.release(0.01)
+    assert limit.try_acquire()
+
+
+def test_limit_grows_by_one_when_it_is_used():
+    limit = AdaptiveLimit("test", initial_limit=MIN_WINDOW, min_limit=1, max_limit=100)
+    run_window(limit, MIN_WINDOW)
+    assert limit.limit == MIN_WINDOW + 1
+
+
+def test_limit_stays_when_it_is_not_used():
+    limit = AdaptiveLimit("test", initial_limit=MIN_WINDOW, min_limit=1, max_limit=100)
+    for _ in range(MIN_WINDOW):
+        run_window(limit, 1)
+    assert limit.limit == MIN_WINDOW
+
+
+def test_limit_is_halved_on_failures():
+    limit = AdaptiveLimit("test", initial_limit=20, min_limit=1, max_limit=100)
+    run_window(limit, 20, failed=5)
+    assert limit.limit == 10
+
+
+def test_limit_goes_down_when_requests_get_slow():
+    limit = AdaptiveLimit("test", initial_limit=MIN_WINDOW, min_limit=1, max_limit=100)
+    run_window(limit, MIN_WINDOW, latency=0.01)
+    before = limit.limit
+    run_window(limit, before, latency=0.05)
+    assert limit.limit == int(before * 0.9)
+
+
+def test_slow_kind_of_request_has_its_own_baseline():
+    limit = AdaptiveLimit("test", initial_limit=MIN_WINDOW, min_limit=1, max_limit=100)
+    for _ in range(MIN_WINDOW // 2):
+        assert limit.try_acquire()
+        limit.release(0.01, kind="fast")
+        assert limit.try_acquire()
+        limit.release(0.5, kind="slow")
+    assert limit.limit == MIN_WINDOW
+
+
+def test_limit_stays_within_bounds():
+    limit = AdaptiveLimit("test", initial_limit=4, min_limit=3, max_limit=5)
+    for _ in range(2 * MIN_WINDOW):
+        run_window(limit, limit.limit, failed=limit.limit)
+    assert limit.limit == 3
+    for _ in range(10 * MIN_WINDOW):
+        run_window(limit, limit.limit)
+    assert limit.limit == 5
+
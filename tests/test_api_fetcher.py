@@ -0,0 +1,70 @@
+import asyncio
+
+from api_fetcher import AsyncMatchFetcher
+from resilience import RetryPolicy, get_breaker
+from conftest import API_DATA
+
+
+def fetch(server, token, match_ids, max_attempts=3):
+    async def run():
+        async with AsyncMatchFetcher(server.base_url, token, concurrency=4,
+                                     retry_policy=RetryPolicy(max_attempts, backoff=0.01)) as fetcher:
+            return await fetcher.fetch_matches(match_ids)
+    return asyncio.run(run())
+
+
+def test_fetches_matches(make_server, make_token_provider):
+    server = make_server()
+    assert fetch(server, make_token_provider(server), [1, 2]) == API_DATA
+    assert server.token_requests == 1
+
+
+def test_401_gets_a_new_token_once(make_server, make_token_provider):
+    server = make_server(failures={1: [401]})
+    assert fetch(server, make_token_provider(server), [1]) == {1: API_DATA[1]}
+    assert server.token_requests == 2
+    assert server.match_requests == 2
+
+
+def test_second_401_gives_up(make_server, make_token_provider):
+    server = make_server(failures={1: [401, 401]})
+    assert fetch(server, make_token_provider(server), [1]) == {1: None}
+    assert server.token_requests == 2
+
+
+def test_401_with_fixed_token_gives_up(make_server):
+    server = make_server()
+    assert fetch(server, "expired", [1]) == {1: None}
+    assert server.match_requests == 1
+
+
+def test_429_is_retried_after_retry_after(make_server, make_token_provider):
+    server = make_server(failures={1: [429, 429]})
+    assert fetch(server, make_token_provider(server), [1]) == {1: API_DATA[1]}
+    assert server.match_requests == 3
+
+
+def test_5xx_is_retried(make_server, make_token_provider):
+    server = make_server(failures={1: [500, 503]})
+    assert fetch(server, make_token_provider(server), [1, 2]) == API_DATA
+    assert server.match_requests == 4
+    assert get_breaker("api").opened_at is None
+
+
+def test_5xx_gives_none_when_attempts_are_used_up(make_server, make_token_provider):
+    server = make_server(failures={1: [502, 502, 502]})
+    assert fetch(server, make_token_provider(server), [1, 2], max_attempts=3) == {1: None, 2: API_DATA[2]}
+    assert server.match_requests == 4
+
+
+def test_404_is_not_retried(make_server, make_token_provider):
+    server = make_server()
+    assert fetch(server, make_token_provider(server), [3]) == {3: None}
+
+
+def test_chunk_is_skipped_without_token(make_server, make_token_provider):
+    server = make_server(token_status=400)
+    match_ids = list(range(1, 201))
+    assert fetch(server, make_token_provider(server), match_ids) == {match_id: None for match_id in match_ids}
+    assert server.token_requests == 1
+    assert server.match_requests == 0
@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+
+from compare_engine import COMPARISON_COLUMNS, compare_columns, compare_frames, collect_values, \
+    build_comparison_frame
+
+MAPPINGS = [("HOME_TEAM_NAME", "homeTeam.name"), ("GENDER", "league.gender")]
+PLAYER_MAPPINGS = [("MINUTES_PLAYED", "minutesPlayed")]
+
+
+def api_player(player_id, shirt_number, minutes):
+    return {"sourceReferences": [{"sourceValue": str(player_id)}], "shirtNumber": shirt_number,
+            "minutesPlayed": minutes}
+
+
+def api_match(home_players, away_players):
+    return {"league": {"gender": "Male"},
+            "homeTeam": {"name": "Home", "players": home_players},
+            "awayTeam": {"name": "Away", "players": away_players}}
+
+
+def db_players(rows):
+    # rows of (IS_HOME, PLAYER_ID, SHIRT_NUMBER, MINUTES_PLAYED)
+    return pd.DataFrame(rows, columns=["IS_HOME", "PLAYER_ID", "SHIRT_NUMBER", "MINUTES_PLAYED"])
+
+
+DB_DATA = {"HOME_TEAM_NAME": "Home", "GENDER": 1}
+
+
+def player_rows(frame):
+    return frame[frame["API Name"].str.contains("players")]
+
+
+def test_compare_columns_numbers_as_floats_and_the_rest_as_text():
+    db_values = np.array([7, 7, 7.5, "Home", None, True], dtype=object)
+    api_values = np.array([7.0, "7", 7.5, "Home ", None, 1], dtype=object)
+    assert compare_columns(db_values, api_values).tolist() == [True, True, True, False, True, True]
+
+
+def test_match_values_are_compared_per_mapping():
+    frame = compare_frames(1, api_match([], []), DB_DATA, db_players([]), MAPPINGS, PLAYER_MAPPINGS,
+                           normalizers={"GENDER": "gender"})
+    assert list(frame.columns) == COMPARISON_COLUMNS
+    assert frame["DB Column Name"].tolist() == ["HOME_TEAM_NAME", "GENDER"]
+    assert frame["API Value"].tolist() == ["Home", "Male"]
+    assert frame["Match"].tolist() == [True, True]
+
+
+def test_players_are_paired_on_the_shirt_number_whatever_the_api_order():
+    api_data = api_match([api_player(1002, 2, 45), api_player(1001, 1, 90)], [api_player(2009, "9", 30)])
+    players = db_players([(1, 1001, 1, 90), (1, 1002, 2, 90), (0, 2009, 9, 30)])
+    unmatched = []
+    frame = player_rows(compare_frames(1, api_data, DB_DATA, players, MAPPINGS, PLAYER_MAPPINGS,
+                                       unmatched_players=unmatched))
+    # The API names point at the DB row of the player
+    assert frame["API Name"].tolist() == ["homeTeam.players[0].minutesPlayed", "homeTeam.players[1].minutesPlayed",
+                                          "awayTeam.players[2].minutesPlayed"]
+    assert frame["API Value"].tolist() == [90, 45, 30]
+    assert frame["Match"].tolist() == [True, False, True]
+    assert unmatched == []
+
+
+def test_players_are_paired_on_the_player_id_and_the_composite_key():
+    # The shirt numbers are swapped, so only the player id pairs the right players
+    api_data = api_match([api_player(1001, 2, 90), api_player(1002, 1, 45)], [])
+    players = db_players([(1, 1001, 1, 90), (1, 1002, 2, 45)])
+    frame = player_rows(compare_frames(1, api_data, DB_DATA, players, MAPPINGS, PLAYER_MAPPINGS,
+                                       player_key="player_id"))
+    assert frame["Match"].tolist() == [True, True]
+
+    unmatched = []
+    frame = player_rows(compare_frames(1, api_data, DB_DATA, players, MAPPINGS, PLAYER_MAPPINGS,
+                                       player_key="composite", unmatched_players=unmatched))
+    assert len(frame) == 0
+    assert [(player["Source"], player["Key"]) for player in unmatched] == [("DB", "1001/1"), ("DB", "1002/2"),
+                                                                           ("API", "1001/2"), ("API", "1002/1")]
+
+
+def test_unmatched_players_are_reported_in_the_list():
+    api_data = api_match([api_player(1001, 1, 90), api_player(1003, 3, 10)], [])
+    players = db_players([(1, 1001, 1, 90), (1, 1002, 2, 45), (0, 2009, 9, 30)])
+    unmatched = []
+    frame = player_rows(compare_frames(7, api_data, DB_DATA, players, MAPPINGS, PLAYER_MAPPINGS,
+                                       unmatched_players=unmatched))
+    assert frame["API Name"].tolist() == ["homeTeam.players[0].minutesPlayed"]
+    assert unmatched == [
+        {"Match ID": 7, "Team": "homeTeam", "Source": "DB", "Key": "2"},
+        {"Match ID": 7, "Team": "homeTeam", "Source": "API", "Key": "3"},
+        {"Match ID": 7, "Team": "awayTeam", "Source": "DB", "Key": "9"},
+    ]
+
+
+def test_unmatched_players_are_printed_without_a_list(capsys):
+    api_data = api_match([api_player(1001, 1, 90)], [])
+    compare_frames(7, api_data, DB_DATA, db_players([(1, 1001, 1, 90), (1, 1002, 2, 45)]), MAPPINGS,
+                   PLAYER_MAPPINGS)
+    assert capsys.readouterr().out == "Unmatched players of match 7 on shirt_number: DB homeTeam 2\n"
+
+
+def test_matches_concatenated_give_the_same_frame():
+    # compare_match_chunk normalises the values of a whole chunk at once
+    first = collect_values(1, api_match([api_player(1001, 1, 90)], []), DB_DATA,
+                           db_players([(1, 1001, 1, 90)]), MAPPINGS, PLAYER_MAPPINGS)
+    second = collect_values(2, api_match([], [api_player(2009, 9, 30)]), {"HOME_TEAM_NAME": "Home", "GENDER": 2},
+                            db_players([(0, 2009, 9, "30")]), MAPPINGS, PLAYER_MAPPINGS)
+    normalizers = {"GENDER": "gender", "MINUTES_PLAYED": "int"}
+    chunk = build_comparison_frame(*[np.concatenate(parts) for parts in zip(first, second)], normalizers)
+    per_match = pd.concat([build_comparison_frame(*first, normalizers), build_comparison_frame(*second, normalizers)],
+                          ignore_index=True)
+    pd.testing.assert_frame_equal(chunk, per_match)
+    assert chunk["Match"].tolist() == [True, True, True, True, False, True]
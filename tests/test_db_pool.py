@@ -0,0 +1,67 @@
+import sqlite3
+
+import pytest
+
+from db_pool import ConnectionPool
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "pool.sqlite")
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE MATCHES (MATCH_ID INTEGER PRIMARY KEY, NAME TEXT)")
+        conn.executemany("INSERT INTO MATCHES VALUES (?, ?)", [(1, "one"), (2, "two")])
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def connections(db_path):
+    # The sqlite connections the pool opened, in order
+    opened = []
+
+    def connect():
+        conn = sqlite3.connect(db_path, check_same_thread=False)
+        opened.append(conn)
+        return conn
+    return opened, connect
+
+
+def test_read_query(connections):
+    _, connect = connections
+    pool = ConnectionPool(connect)
+    columns, rows = pool.read_query("SELECT MATCH_ID, NAME FROM MATCHES WHERE MATCH_ID = ?", (2,))
+    assert columns == ["MATCH_ID", "NAME"]
+    assert rows == [(2, "two")]
+    pool.close()
+
+
+def test_reconnects_when_the_connection_dropped_during_the_query(connections):
+    opened, connect = connections
+    pool = ConnectionPool(connect, health_check_interval=3600)
+    opened[0].close()
+    _, rows = pool.read_query("SELECT NAME FROM MATCHES WHERE MATCH_ID = ?", (1,))
+    assert rows == [("one",)]
+    assert len(opened) == 2
+    pool.close()
+
+
+def test_idle_dropped_connection_is_replaced(connections):
+    opened, connect = connections
+    pool = ConnectionPool(connect, health_check_interval=0)
+    opened[0].close()
+    with pool.connection() as pooled:
+        assert pooled.read_query("SELECT COUNT(*) FROM MATCHES")[1] == [(2,)]
+    assert len(opened) == 2
+    pool.close()
+
+
+def test_query_error_keeps_the_connection(connections):
+    opened, connect = connections
+    pool = ConnectionPool(connect)
+    with pytest.raises(sqlite3.OperationalError):
+        pool.read_query("SELECT * FROM NO_SUCH_TABLE")
+    pool.read_query("SELECT 1")
+    assert len(opened) == 1
+    pool.close()
+
@@ -0,0 +1,84 @@
+import datetime
+import decimal
+
+import numpy as np
+import pandas as pd
+
+from compare_engine import compare_columns
+from db_reader import read_frame, frame_reader
+
+
+class FakeCursor:
+    # Executed cursor with a pyodbc like description, records the fetchmany sizes
+    def __init__(self, columns, rows):
+        self.description = [(name, column_type, None, None, None, None, True) for name, column_type in columns]
+        self.rows = list(rows)
+        self.arraysize = 1
+        self.fetch_sizes = []
+
+    def fetchmany(self, size):
+        self.fetch_sizes.append(size)
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+
+def test_int_column_with_null_keeps_python_ints():
+    cursor = FakeCursor([("AREA_ID", int)], [(123,), (None,), (456,)])
+    frame = read_frame(cursor, {"AREA_ID": "int"})
+    assert frame["AREA_ID"].dtype == object
+    assert frame["AREA_ID"].tolist() == [123, None, 456]
+    # 123.0 would no longer match the string of the API
+    assert compare_columns(frame["AREA_ID"].to_numpy(), np.array(["123", None, "456"], dtype=object)).tolist() \
+        == [True, True, True]
+
+
+def test_null_in_one_batch_makes_the_whole_column_object():
+    cursor = FakeCursor([("AREA_ID", int)], [(1,), (2,), (None,)])
+    frame = read_frame(cursor, {"AREA_ID": "int"}, arraysize=2)
+    assert frame["AREA_ID"].dtype == object
+    assert frame["AREA_ID"].tolist() == [1, 2, None]
+
+
+def test_typed_columns_without_nulls():
+    cursor = FakeCursor([("MATCH_ID", int), ("RATING", decimal.Decimal), ("STARTING", bool)],
+                        [(1, decimal.Decimal("7.5"), True), (2, None, False)])
+    frame = read_frame(cursor, {"MATCH_ID": "int", "STARTING": "bool"})
+    assert frame["MATCH_ID"].dtype == np.int64
+    assert frame["STARTING"].dtype == bool
+    # Float columns come from the description, NULL becomes NaN
+    assert frame["RATING"].dtype == np.float64
+    assert frame["RATING"].iloc[0] == 7.5
+    assert np.isnan(frame["RATING"].iloc[1])
+
+
+def test_datetime_column():
+    kickoff = datetime.datetime(2024, 8, 1, 15)
+    cursor = FakeCursor([("KICKOFF_DATE", datetime.datetime)], [(kickoff,), (None,)])
+    frame = read_frame(cursor)
+    assert pd.api.types.is_datetime64_any_dtype(frame["KICKOFF_DATE"])
+    assert frame["KICKOFF_DATE"].iloc[0] == pd.Timestamp(kickoff)
+    assert pd.isna(frame["KICKOFF_DATE"].iloc[1])
+
+
+def test_rows_are_fetched_arraysize_at_a_time():
+    cursor = FakeCursor([("MATCH_ID", int), ("NAME", str)], [(match_id, f"Match {match_id}") for match_id in range(5)])
+    frame = frame_reader({"MATCH_ID": "int"}, arraysize=2)(cursor)
+    assert cursor.arraysize == 2
+    assert cursor.fetch_sizes == [2, 2, 2, 2]
+    assert frame["MATCH_ID"].tolist() == [0, 1, 2, 3, 4]
+    assert frame["NAME"].tolist() == [f"Match {match_id}" for match_id in range(5)]
+
+
+def test_empty_result_keeps_the_columns_and_types():
+    cursor = FakeCursor([("MATCH_ID", int), ("KICKOFF_DATE", datetime.datetime)], [])
+    frame = read_frame(cursor, {"MATCH_ID": "int"})
+    assert list(frame.columns) == ["MATCH_ID", "KICKOFF_DATE"]
+    assert len(frame) == 0
+    assert frame["MATCH_ID"].dtype == np.int64
+    assert pd.api.types.is_datetime64_any_dtype(frame["KICKOFF_DATE"])
+
+
+def test_untyped_column_gets_the_inferred_dtype():
+    cursor = FakeCursor([("EXTRA", bytearray)], [(1,), (2,)])
+    frame = read_frame(cursor)
+    assert frame["EXTRA"].dtype == np.int64
@@ -0,0 +1,134 @@
+import pytest
+
+# The batch runs read the DB through compare_match, which needs the ODBC driver
+pytest.importorskip("pyodbc")
+
+import job_runner
+from job_runner import Journal, run_job
+
+
+class FakeBatch:
+    # Stands in for compare_match_batch: journals every match as its own chunk.
+    # outcome(match_id, attempt) gives "done", a failure reason, or "crash" to stop the run with an error.
+    def __init__(self, outcome):
+        self.outcome = outcome
+        self.runs = []
+
+    def __call__(self, environment, match_ids, csv_filename, journal=None, **batch_options):
+        attempt = len(self.runs) + 1
+        run = []
+        self.runs.append(run)
+        failed = []
+        for match_id in match_ids:
+            run.append(match_id)
+            outcome = self.outcome(match_id, attempt)
+            if outcome == "crash":
+                raise RuntimeError(f"run stopped at match {match_id}")
+            if outcome == "done":
+                journal.record([match_id])
+            else:
+                failed.append(match_id)
+                journal.record(failed={match_id: outcome})
+        return failed
+
+
+@pytest.fixture
+def journal_file(tmp_path):
+    return str(tmp_path / "job.jsonl")
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(job_runner.time, "sleep", sleeps.append)
+    return sleeps
+
+
+def use_batch(monkeypatch, outcome):
+    batch = FakeBatch(outcome)
+    monkeypatch.setattr(job_runner, "compare_match_batch", batch)
+    return batch
+
+
+def statuses(journal_file):
+    return {match_id: entry["status"] for match_id, entry in Journal(journal_file).load().items()}
+
+
+def test_journal_keeps_the_last_entry_and_skips_half_written_lines(journal_file):
+    journal = Journal(journal_file)
+    assert journal.load() == {}
+    journal.record(failed={1: "no_api_data", 2: "no_db_rows"})
+    journal.record(done=[1], failed={2: "no_db_rows"}, status="gave_up")
+    with open(journal_file, "a") as f:
+        f.write('{"match_id": 3, "sta')
+    entries = journal.load()
+    assert set(entries) == {1, 2}
+    assert entries[1]["status"] == "done"
+    assert entries[2] == {"match_id": 2, "status": "gave_up", "reason": "no_db_rows", "at": entries[2]["at"]}
+
+
+def test_finished_job_is_not_run_again(monkeypatch, journal_file, sleeps, capsys):
+    batch = use_batch(monkeypatch, lambda match_id, attempt: "done")
+    assert run_job("test", [1, 2, 3], "out_", journal_file) == []
+    assert batch.runs == [[1, 2, 3]]
+    assert statuses(journal_file) == {1: "done", 2: "done", 3: "done"}
+
+    assert run_job("test", [1, 2, 3, 4], "out_", journal_file) == []
+    assert batch.runs[1:] == [[4]]
+    assert "3 of 4 matches were already finished." in capsys.readouterr().out
+    assert sleeps == []
+
+
+def test_failed_matches_are_tried_again_after_a_backoff(monkeypatch, journal_file, sleeps):
+    batch = use_batch(monkeypatch, lambda match_id, attempt: "no_api_data" if match_id == 2 and attempt < 3
+                      else "done")
+    assert run_job("test", [1, 2, 3], "out_", journal_file, backoff=1.0) == []
+    assert batch.runs == [[1, 2, 3], [2], [2]]
+    assert len(sleeps) == 2
+    assert statuses(journal_file) == {1: "done", 2: "done", 3: "done"}
+
+
+def test_matches_without_db_rows_are_given_up_right_away(monkeypatch, journal_file, sleeps):
+    batch = use_batch(monkeypatch, lambda match_id, attempt: "no_db_rows" if match_id == 2 else "done")
+    assert run_job("test", [1, 2, 3], "out_", journal_file) == [2]
+    assert batch.runs == [[1, 2, 3]]
+    assert Journal(journal_file).load()[2]["reason"] == "no_db_rows"
+
+    # A new run of the job skips them, unless retry_gave_up is set
+    assert run_job("test", [1, 2, 3], "out_", journal_file) == [2]
+    assert batch.runs[1:] == [[]]
+    run_job("test", [1, 2, 3], "out_", journal_file, retry_gave_up=True)
+    assert batch.runs[2:] == [[2]]
+
+
+def test_matches_are_given_up_after_max_attempts(monkeypatch, journal_file, sleeps):
+    batch = use_batch(monkeypatch, lambda match_id, attempt: "no_api_data" if match_id == 1 else "done")
+    assert run_job("test", [1, 2], "out_", journal_file, max_attempts=3) == [1]
+    assert batch.runs == [[1, 2], [1], [1]]
+    entry = Journal(journal_file).load()[1]
+    assert (entry["status"], entry["reason"]) == ("gave_up", "max_attempts")
+
+
+def test_run_that_stops_continues_with_the_rest(monkeypatch, journal_file, sleeps):
+    batch = use_batch(monkeypatch, lambda match_id, attempt: "crash" if match_id == 2 and attempt == 1 else "done")
+    # The ids stream in, duplicates are compared once
+    assert run_job("test", (match_id for match_id in [1, 2, 2, 3]), "out_", journal_file) == []
+    # The second run gets the match it stopped at and the ids the first run did not get to
+    assert batch.runs == [[1, 2], [2, 3]]
+    assert statuses(journal_file) == {1: "done", 2: "done", 3: "done"}
+
+
+def test_workers_run_the_job_in_parallel(monkeypatch, journal_file, sleeps):
+    parallel_runs = []
+
+    def compare_match_parallel(environment, match_ids, csv_filename, workers, journal=None, **batch_options):
+        parallel_runs.append((list(match_ids), workers, batch_options))
+        return []
+
+    monkeypatch.setattr(job_runner, "compare_match_parallel", compare_match_parallel)
+    batch = use_batch(monkeypatch, lambda match_id, attempt: "done")
+    assert run_job("test", [1, 2], "out_", journal_file, workers=2, output_file="out.csv") == []
+    assert parallel_runs == [([1, 2], 2, {"output_file": "out.csv"})]
+    assert batch.runs == []
+    # Matches the run did not journal itself are journaled as done when it returns
+    assert statuses(journal_file) == {1: "done", 2: "done"}
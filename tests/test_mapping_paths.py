@@ -0,0 +1,55 @@
+import pytest
+
+from mapping_paths import WILDCARD, compile_path, compile_mappings, parse_path
+
+MATCH = {
+    "kickOffDate": "2024-08-01T15:00:00",
+    "homeTeam": {
+        "sourceReferences": [{"sourceValue": "10"}],
+        "players": [{"shirtNumber": 1, "stats": {"goals": 2}}, {"shirtNumber": 7}],
+    },
+}
+
+
+def test_parse_path_splits_keys_and_indexes():
+    assert parse_path("homeTeam.sourceReferences[0].sourceValue") == ("homeTeam", "sourceReferences", 0,
+                                                                      "sourceValue")
+    assert parse_path("homeTeam.players[*].shirtNumber") == ("homeTeam", "players", WILDCARD, "shirtNumber")
+    assert parse_path("grid[1][2]") == ("grid", 1, 2)
+
+
+def test_get_follows_keys_and_indexes():
+    assert compile_path("kickOffDate").get(MATCH) == "2024-08-01T15:00:00"
+    assert compile_path("homeTeam.sourceReferences[0].sourceValue").get(MATCH) == "10"
+    assert compile_path("homeTeam.players[1].shirtNumber").get(MATCH) == 7
+
+
+def test_wildcard_returns_one_value_per_item():
+    assert compile_path("homeTeam.players[*].shirtNumber").get(MATCH) == [1, 7]
+
+
+def test_wildcard_gives_the_default_per_missing_item():
+    assert compile_path("homeTeam.players[*].stats.goals").get(MATCH, None) == [2, None]
+
+
+def test_missing_key_raises_without_default():
+    with pytest.raises(KeyError):
+        compile_path("awayTeam.name").get(MATCH)
+    with pytest.raises(IndexError):
+        compile_path("homeTeam.players[5].shirtNumber").get(MATCH)
+    with pytest.raises(KeyError):
+        compile_path("homeTeam.players[*].stats.goals").get(MATCH)
+
+
+def test_missing_key_gives_the_default():
+    assert compile_path("awayTeam.name").get(MATCH, None) is None
+    assert compile_path("homeTeam.players[5].shirtNumber").get(MATCH, "") == ""
+    # Indexing into a value that is not a list or dict
+    assert compile_path("kickOffDate.value").get(MATCH, None) is None
+
+
+def test_paths_are_compiled_once():
+    assert compile_path("homeTeam.players[*].shirtNumber") is compile_path("homeTeam.players[*].shirtNumber")
+    (db_column, api_name, path), = compile_mappings([("KICKOFF_DATE", "kickOffDate")])
+    assert (db_column, api_name) == ("KICKOFF_DATE", "kickOffDate")
+    assert path is compile_path("kickOffDate")
@@ -0,0 +1,118 @@
+import pytest
+
+# match_sampling reads the DB config through compare_match, which needs the ODBC driver
+pytest.importorskip("pyodbc")
+
+import match_sampling
+from match_sampling import StratifiedSample, get_sample_size, allocate_sample, get_wilson_interval, \
+    read_mismatched_mappings
+
+# (match id, league id, season id) of the population, league 1 has 60 matches and league 2 has 40
+POPULATION = [(match_id, 1 if match_id <= 60 else 2, 10) for match_id in range(1, 101)]
+
+
+class FakePool:
+    # Answers the stratum query and the pages of the discovery query from POPULATION
+    def read_query(self, query, params=()):
+        if query.startswith("SELECT TOP"):
+            page_size, last_match_id = params[:2]
+            return None, [row for row in POPULATION if row[0] > last_match_id][:page_size]
+        sizes = {}
+        for _, league_id, season_id in POPULATION:
+            sizes[(league_id, season_id)] = sizes.get((league_id, season_id), 0) + 1
+        return None, [(league_id, season_id, size) for (league_id, season_id), size in sizes.items()]
+
+
+@pytest.fixture
+def sample(monkeypatch):
+    monkeypatch.setattr(match_sampling, "get_config_files", lambda environment: (None, None))
+    monkeypatch.setattr(match_sampling, "get_db_config", lambda db_config_file: None)
+    monkeypatch.setattr(match_sampling, "get_db_pool", lambda db_config: FakePool())
+    return StratifiedSample("test", margin=0.2, seed=1, page_size=30)
+
+
+def test_sample_size():
+    assert get_sample_size(0) == 0
+    assert get_sample_size(10 ** 9) == 385
+    # Finite population correction
+    assert get_sample_size(1000) == 278
+    assert get_sample_size(50) == 45
+    assert get_sample_size(10) == 10
+    assert get_sample_size(10 ** 9, expected_rate=0.1) < get_sample_size(10 ** 9)
+    assert get_sample_size(10 ** 9, confidence=0.99) > get_sample_size(10 ** 9)
+
+
+def test_allocation_is_proportional():
+    allocation = allocate_sample({"a": 600, "b": 300, "c": 100}, 100)
+    assert allocation == {"a": 60, "b": 30, "c": 10}
+    # The largest remainders get the matches left over
+    assert allocate_sample({"a": 1, "b": 1, "c": 1}, 2, min_per_stratum=0) == {"a": 1, "b": 1, "c": 0}
+
+
+def test_allocation_gives_small_strata_their_minimum():
+    allocation = allocate_sample({"a": 1000, "b": 5, "c": 1}, 50)
+    assert allocation["b"] == 2
+    # A stratum never gets more matches than it has
+    assert allocation["c"] == 1
+    assert allocate_sample({"a": 0}, 10) == {"a": 0}
+
+
+def test_wilson_interval():
+    assert get_wilson_interval(0.5, 0.0, 0, 1.96) == (0.0, 1.0)
+    low, high = get_wilson_interval(0.0, 0.0, 100, 1.96)
+    # Unlike the normal interval it does not collapse to a point for a rate of 0
+    assert low == 0.0
+    assert 0.0 < high < 0.05
+    low, high = get_wilson_interval(0.2, 0.0016, 100, 1.96)
+    assert low < 0.2 < high
+    assert high - low == pytest.approx(2 * 1.96 * 0.04, rel=0.1)
+
+
+def test_sample_takes_the_allocated_matches_per_stratum(sample):
+    assert sample.population == 100
+    assert sample.sample_size == 20
+    assert sample.allocation == {(1, 10): 12, (2, 10): 8}
+    match_ids = list(sample.match_ids())
+    assert match_ids == sorted(match_ids)
+    assert sum(1 for match_id in match_ids if match_id <= 60) == 12
+    assert sum(1 for match_id in match_ids if match_id > 60) == 8
+    assert set(sample.strata) == set(match_ids)
+
+
+def test_sample_is_reproducible_with_a_seed(sample):
+    match_ids = list(sample.match_ids())
+    assert list(sample.match_ids()) == match_ids
+
+
+def test_estimate_weights_the_strata(sample):
+    match_ids = list(sample.match_ids())
+    league_1 = [match_id for match_id in match_ids if match_id <= 60]
+    # Half of the sampled matches of league 1 mismatch, none of league 2
+    mismatched = {match_id: {"LEAGUE_NAME"} for match_id in league_1[:6]}
+    rows = {row["Mapping"]: row for row in sample.estimate(mismatched)}
+    assert rows["LEAGUE_NAME"]["Estimated Rate"] == pytest.approx(0.6 * 0.5)
+    assert rows["LEAGUE_NAME"]["Mismatching Matches"] == 6
+    assert rows["LEAGUE_NAME"]["Sampled Matches"] == 20
+    assert rows["LEAGUE_NAME"]["CI Low"] < 0.3 < rows["LEAGUE_NAME"]["CI High"]
+    assert rows["(any)"]["Estimated Rate"] == pytest.approx(0.3)
+    assert rows["KICKOFF_DATE"]["Estimated Rate"] == 0.0
+
+
+def test_estimate_leaves_out_failed_matches(sample, capsys):
+    match_ids = list(sample.match_ids())
+    league_2 = [match_id for match_id in match_ids if match_id > 60]
+    rows = {row["Mapping"]: row for row in sample.estimate({league_2[0]: {"LEAGUE_NAME"}}, league_2[1:])}
+    # The one compared match of league 2 mismatches, the stratum weighs 40%
+    assert rows["LEAGUE_NAME"]["Sampled Matches"] == 13
+    assert rows["LEAGUE_NAME"]["Estimated Rate"] == pytest.approx(0.4)
+    rows = sample.estimate({}, league_2)
+    assert "40 of 100 matches are in strata without compared matches" in capsys.readouterr().out
+    assert rows[-1]["Sampled Matches"] == 12
+
+
+def test_read_mismatched_mappings(tmp_path):
+    path = tmp_path / "mismatches.csv"
+    assert read_mismatched_mappings(str(path)) == {}
+    path.write_text("Match ID,DB Column Name,API Name\n1,LEAGUE_NAME,league.name\n1,GENDER,league.gender\n"
+                    "2,GENDER,league.gender\n")
+    assert read_mismatched_mappings(str(path)) == {1: {"LEAGUE_NAME", "GENDER"}, 2: {"GENDER"}}
@@ -0,0 +1,73 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from normalizers import normalize_datetime, normalize_gender, normalize_bool, normalize_int, normalize_float, \
+    normalize_text, normalize_casefold, normalize_columns
+
+
+def values(*items):
+    array = np.empty(len(items), dtype=object)
+    array[:] = items
+    return array
+
+
+def test_datetime_of_the_db_and_the_api_are_the_same_string():
+    db_values = values(pd.Timestamp("2024-08-01 15:00:00"), datetime.datetime(2024, 8, 1, 15),
+                       np.datetime64("2024-08-01T15:00:00"), datetime.date(2024, 8, 1))
+    api_values = values("2024-08-01T15:00:00Z", "2024-08-01T17:00:00+02:00", "2024-08-01T15:00:00.000",
+                        "2024-08-01")
+    expected = ["2024-08-01T15:00:00", "2024-08-01T15:00:00", "2024-08-01T15:00:00", "2024-08-01T00:00:00"]
+    assert normalize_datetime(db_values).tolist() == expected
+    assert normalize_datetime(api_values).tolist() == expected
+
+
+def test_datetime_keeps_what_it_does_not_understand():
+    result = normalize_datetime(values(pd.NaT, None, "not a date", 5))
+    assert pd.isna(result[0])
+    assert result[1:].tolist() == [None, "not a date", 5]
+
+
+def test_normalisers_do_not_change_their_input():
+    original = values(" Text ", "2024-08-01T15:00:00Z")
+    for normalize in (normalize_datetime, normalize_text, normalize_casefold, normalize_bool, normalize_int):
+        normalize(original)
+        assert original.tolist() == [" Text ", "2024-08-01T15:00:00Z"]
+
+
+def test_gender():
+    assert normalize_gender(values(1, 2)).tolist() == ["Male", "Female"]
+
+
+def test_bool():
+    assert normalize_bool(values(1, 0, 1.0, True, "true", " No ", "YES", "0", "maybe", None)).tolist() \
+        == [True, False, True, True, True, False, True, False, "maybe", None]
+
+
+def test_int():
+    result = normalize_int(values("7", 7.0, 7, " 8 ", 7.5, "x", True, None))
+    assert result.tolist() == [7, 7, 7, 8, 7.5, "x", True, None]
+    assert all(type(value) is not str for value in result[:4])
+
+
+def test_float():
+    assert normalize_float(values("0.1234567", 0.1234571, 2, "x", False)).tolist() \
+        == [0.123457, 0.123457, 2.0, "x", False]
+
+
+def test_text_and_casefold():
+    assert normalize_text(values(" Team A ", 5, None)).tolist() == ["Team A", 5, None]
+    assert normalize_casefold(values(" Team A ", "STRASSE", 5)).tolist() == ["team a", "strasse", 5]
+
+
+def test_normalize_columns_only_touches_the_rows_of_the_named_columns():
+    db_names = values("GENDER", "LEAGUE_NAME", "SHIRT_NUMBER", "GENDER")
+    db_values = values(1, " League ", "7", 2)
+    api_values = values("Male", "league ", "7", "Female")
+    db_result, api_result = normalize_columns(db_names, db_values, api_values,
+                                              {"GENDER": "gender", "LEAGUE_NAME": "casefold", "HOME_TEAM_NAME": "text"})
+    assert db_result.tolist() == ["Male", "league", "7", "Female"]
+    # The API side of gender is kept as it is
+    assert api_result.tolist() == ["Male", "league", "7", "Female"]
+    assert db_values.tolist() == [1, " League ", "7", 2]
@@ -0,0 +1,104 @@
+import sqlite3
+
+import pytest
+
+from query_builder import build_match_query, build_player_query, build_checksum_query, build_match_conditions, \
+    build_discovery_query, build_stratum_query, MATCH_JOINS
+
+# The tables the queries read, with the columns the tests map
+SCHEMA = [
+    "CREATE TABLE SEASONS (SEASON_ID INTEGER PRIMARY KEY, NAME TEXT, START_DATE TEXT, END_DATE TEXT)",
+    "CREATE TABLE LEAGUES (LEAGUE_ID INTEGER PRIMARY KEY, NAME TEXT, GENDER INTEGER, AREA_ID INTEGER)",
+    "CREATE TABLE TEAMS (TEAM_ID INTEGER PRIMARY KEY, NAME TEXT)",
+    """CREATE TABLE MATCHES (MATCH_ID INTEGER PRIMARY KEY, SEASON_ID INTEGER, LEAGUE_ID INTEGER,
+        HOME_TEAM_ID INTEGER, AWAY_TEAM_ID INTEGER, KICKOFF_DATE TEXT)""",
+    "CREATE TABLE MATCH_TEAM_PLAYERS (MATCH_ID INTEGER, TEAM_ID INTEGER, PLAYER_ID INTEGER, SHIRT_NUMBER INTEGER)",
+    "INSERT INTO SEASONS VALUES (1, '2024/2025', '2024-07-01', '2025-06-30')",
+    "INSERT INTO LEAGUES VALUES (3, 'League', 1, 2003)",
+    "INSERT INTO TEAMS VALUES (10, 'Home'), (20, 'Away')",
+    "INSERT INTO MATCHES VALUES (5, 1, 3, 10, 20, '2024-08-01 15:00:00'), (6, 1, 3, 20, 10, '2024-08-08 15:00:00')",
+    "INSERT INTO MATCH_TEAM_PLAYERS VALUES (5, 10, 1001, 1), (5, 20, 2007, 7), (6, 20, 2009, 9)",
+]
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    for statement in SCHEMA:
+        conn.execute(statement)
+    yield conn
+    conn.close()
+
+
+def columns(cursor):
+    return [column[0] for column in cursor.description]
+
+
+def test_match_query_only_joins_the_tables_of_the_mapped_columns(conn):
+    query = build_match_query([("KICKOFF_DATE", "kickOffDate"), ("HOME_TEAM_NAME", "homeTeam.name")])
+    assert MATCH_JOINS["TH"] in query
+    for alias in ("S", "L", "TA"):
+        assert MATCH_JOINS[alias] not in query
+
+    cursor = conn.execute(query, (5,))
+    assert columns(cursor) == ["MATCH_ID", "LEAGUE_ID", "KICKOFF_DATE", "HOME_TEAM_NAME"]
+    assert cursor.fetchall() == [(5, 3, "2024-08-01 15:00:00", "Home")]
+
+
+def test_match_query_without_joins(conn):
+    query = build_match_query([("KICKOFF_DATE", "kickOffDate")])
+    assert "JOIN" not in query
+    assert conn.execute(query, (6,)).fetchall() == [(6, 3, "2024-08-08 15:00:00")]
+
+
+def test_match_query_selects_every_column_once(conn):
+    mappings = [("LEAGUE_ID", "league.id"), ("LEAGUE_NAME", "league.name"), ("LEAGUE_NAME", "league.shortName")]
+    cursor = conn.execute(build_match_query(mappings), (5,))
+    assert columns(cursor) == ["MATCH_ID", "LEAGUE_ID", "LEAGUE_NAME"]
+
+
+def test_match_query_with_another_filter(conn):
+    query = build_match_query([("AWAY_TEAM_NAME", "awayTeam.name")], "WHERE M.SEASON_ID = ?")
+    assert conn.execute(query, (1,)).fetchall() == [(5, 3, "Away"), (6, 3, "Home")]
+
+
+def test_player_query_selects_the_key_columns_before_the_mapped_ones(conn):
+    query = build_player_query([("SHIRT_NUMBER", "shirtNumber")], key_columns=[("PLAYER_ID", "id")])
+    cursor = conn.execute(query, (5,))
+    assert columns(cursor) == ["MATCH_ID", "IS_HOME", "PLAYER_ID", "SHIRT_NUMBER"]
+    assert sorted(cursor.fetchall()) == [(5, 0, 2007, 7), (5, 1, 1001, 1)]
+
+
+def test_checksum_query_covers_every_joined_table():
+    query = build_checksum_query("#MATCH_IDS")
+    assert "FROM #MATCH_IDS IDS" in query
+    for alias, join in MATCH_JOINS.items():
+        assert join in query
+        assert f"AS {alias}_CHECKSUM" in query
+    assert "AS MATCH_CHECKSUM" in query
+    assert "AS PLAYERS_CHECKSUM" in query
+
+
+def test_match_conditions_and_params():
+    conditions, params = build_match_conditions(season_ids=[1], league_ids=[3, 4], kickoff_from="2024-08-01",
+                                                kickoff_to="2024-09-01")
+    assert conditions == ["M.SEASON_ID IN (?)", "M.LEAGUE_ID IN (?, ?)", "M.KICKOFF_DATE >= ?",
+                          "M.KICKOFF_DATE < ?"]
+    assert params == [1, 3, 4, "2024-08-01", "2024-09-01"]
+    assert build_match_conditions() == ([], [])
+
+
+def test_discovery_query_seeks_from_the_last_match_id():
+    query, params = build_discovery_query(league_ids=[3], columns=["LEAGUE_ID", "SEASON_ID"])
+    assert query.startswith("SELECT TOP (?) M.MATCH_ID, M.LEAGUE_ID, M.SEASON_ID")
+    # The page size and the last match id come first, then the filters
+    assert query.index("M.MATCH_ID > ?") < query.index("M.LEAGUE_ID IN (?)")
+    assert "OFFSET" not in query
+    assert params == [3]
+
+
+def test_stratum_query_counts_the_matches_per_league_and_season(conn):
+    query, params = build_stratum_query(kickoff_from="2024-08-05")
+    assert conn.execute(query, params).fetchall() == [(3, 1, 1)]
+    query, params = build_stratum_query()
+    assert conn.execute(query, params).fetchall() == [(3, 1, 2)]
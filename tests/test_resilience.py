@@ -0,0 +1,89 @@
+import time
+
+import pytest
+import requests
+
+from resilience import CircuitBreaker, RetryPolicy, parse_retry_after, request_with_retry
+
+
+class Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def close(self):
+        pass
+
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=60)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.get_wait() == 0
+    breaker.record_failure()
+    assert breaker.get_wait() > 59
+
+
+def test_success_resets_the_failure_count():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.get_wait() == 0
+
+
+def test_breaker_lets_one_trial_through_and_closes_on_success():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.get_wait() > 0
+    time.sleep(0.06)
+    assert breaker.get_wait() == 0
+    # Other callers wait while the trial runs
+    assert breaker.get_wait() > 0
+    breaker.record_success()
+    assert breaker.get_wait() == 0
+    assert breaker.opened_at is None
+
+
+def test_failed_trial_opens_the_breaker_again():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.get_wait() == 0
+    breaker.record_failure()
+    assert breaker.get_wait() > 0.04
+    assert not breaker.trial_running
+
+
+def test_request_with_retry_retries_retry_statuses():
+    responses = [Response(503), Response(429, {"Retry-After": "0"}), Response(200)]
+    breaker = CircuitBreaker("test", failure_threshold=5)
+    response = request_with_retry(lambda: responses.pop(0), RetryPolicy(backoff=0.01), breaker)
+    assert response.status_code == 200
+    assert not responses
+    assert breaker.failures == 0
+
+
+def test_request_with_retry_returns_the_last_response():
+    policy = RetryPolicy(max_attempts=2, backoff=0.01)
+    assert request_with_retry(lambda: Response(500), policy).status_code == 500
+
+
+def test_request_with_retry_raises_the_last_connection_error():
+    calls = []
+
+    def send():
+        calls.append(1)
+        raise requests.ConnectionError("down")
+
+    with pytest.raises(requests.ConnectionError):
+        request_with_retry(send, RetryPolicy(max_attempts=3, backoff=0.01))
+    assert len(calls) == 3
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("5") == 5.0
+    assert parse_retry_after("100000") == 300
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(None) is None
@@ -0,0 +1,127 @@
+import gzip
+import os
+
+import pandas as pd
+import pytest
+
+from compare_engine import COMPARISON_COLUMNS
+from result_sink import CsvSink, SummarySink, DatasetSink, append_parts, get_commit_file, get_part_file
+
+
+def comparison_frame(matches=(True, False)):
+    return pd.DataFrame({
+        'DB Column Name': [f"COLUMN_{index}" for index in range(len(matches))],
+        'API Name': [f"column{index}" for index in range(len(matches))],
+        'DB Value': [index for index in range(len(matches))],
+        'API Value': [index if match else -1 for index, match in enumerate(matches)],
+        'Match': list(matches),
+    }, columns=COMPARISON_COLUMNS)
+
+
+def read_match_ids(path):
+    if not os.path.exists(path):
+        return []
+    return pd.read_csv(path)['Match ID'].tolist()
+
+
+def crash_after_checkpoint(path, header=True):
+    # A journaled run that checkpoints match 1 and dies while writing match 2
+    sink = CsvSink(path, header)
+    sink.checkpoint()
+    sink.write(1, comparison_frame())
+    sink.checkpoint()
+    sink.write(2, comparison_frame())
+    sink.handle.close()
+
+
+@pytest.mark.parametrize("file_name", ["out.csv", "out.csv.gz"])
+def test_close_after_checkpoint_drops_the_rows_after_it(tmp_path, file_name):
+    path = str(tmp_path / file_name)
+    with CsvSink(path) as sink:
+        sink.checkpoint()
+        sink.write(1, comparison_frame())
+        sink.checkpoint()
+        sink.write(2, comparison_frame())
+    assert read_match_ids(path) == [1, 1]
+    assert not os.path.exists(get_commit_file(path))
+
+
+@pytest.mark.parametrize("file_name", ["out.csv", "out.csv.gz"])
+def test_resume_after_crash_keeps_the_checkpointed_rows(tmp_path, file_name):
+    path = str(tmp_path / file_name)
+    crash_after_checkpoint(path)
+    with CsvSink(path) as sink:
+        sink.checkpoint()
+        sink.write(2, comparison_frame())
+        sink.checkpoint()
+    assert read_match_ids(path) == [1, 1, 2, 2]
+    if file_name.endswith(".gz"):
+        with gzip.open(path, "rt") as f:
+            assert len(f.read().splitlines()) == 5
+
+
+def test_appending_without_journal_after_crash_keeps_every_row(tmp_path):
+    path = str(tmp_path / "out.csv")
+    crash_after_checkpoint(path)
+    with CsvSink(path) as sink:
+        sink.write(3, comparison_frame())
+    assert read_match_ids(path) == [1, 1, 3, 3]
+    assert not os.path.exists(get_commit_file(path))
+    with CsvSink(path) as sink:
+        sink.write(4, comparison_frame())
+    assert read_match_ids(path) == [1, 1, 3, 3, 4, 4]
+
+
+def test_summary_counts_only_checkpointed_matches(tmp_path):
+    path = str(tmp_path / "out.csv")
+    summary_file = str(tmp_path / "summary")
+    with SummarySink(CsvSink(path), summary_file, mismatches_only=True) as sink:
+        sink.checkpoint()
+        sink.write(1, comparison_frame())
+        sink.checkpoint()
+        sink.write(2, comparison_frame())
+    assert read_match_ids(path) == [1]
+    assert read_match_ids(summary_file + "_matches.csv") == [1]
+    mappings = pd.read_csv(summary_file + "_mappings.csv")
+    assert mappings['Total'].tolist() == [1, 1]
+    assert mappings['Mismatched'].tolist() == [0, 1]
+
+
+def test_summary_match_file_after_crash(tmp_path):
+    summary_file = str(tmp_path / "summary")
+    sink = SummarySink(CsvSink(str(tmp_path / "out.csv")), summary_file)
+    sink.checkpoint()
+    sink.write(1, comparison_frame())
+    sink.checkpoint()
+    sink.write(2, comparison_frame())
+    sink.match_file.close()
+    sink.sink.handle.close()
+
+    with SummarySink(CsvSink(str(tmp_path / "out.csv")), summary_file) as sink:
+        sink.write(3, comparison_frame())
+    with SummarySink(CsvSink(str(tmp_path / "out.csv")), summary_file) as sink:
+        sink.write(4, comparison_frame())
+    assert read_match_ids(summary_file + "_matches.csv") == [1, 3, 4]
+
+
+def test_append_parts_cuts_parts_back_to_their_checkpoint(tmp_path):
+    path = str(tmp_path / "out.csv.gz")
+    part_files = [get_part_file(path, index) for index in range(2)]
+    with CsvSink(part_files[0], header=False) as sink:
+        sink.write(1, comparison_frame())
+    crash_after_checkpoint(part_files[1], header=False)
+    append_parts(path, part_files)
+    assert read_match_ids(path) == [1, 1, 1, 1]
+    assert not any(os.path.exists(part_file) for part_file in part_files)
+
+
+def test_dataset_close_after_checkpoint_drops_the_rows_after_it(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = str(tmp_path / "out.parquet")
+    with DatasetSink(path, "test") as sink:
+        sink.write(1, comparison_frame(), league=7)
+        sink.checkpoint()
+        sink.write(2, comparison_frame(), league=7)
+    table = pq.read_table(path)
+    assert table.column("MATCH_ID").to_pylist() == [1, 1]
+    assert table.column("DB_NUMBER").to_pylist() == [0.0, 1.0]
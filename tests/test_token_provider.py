@@ -0,0 +1,57 @@
+import pytest
+
+from resilience import get_breaker
+from token_provider import TokenError, get_token_provider, set_token_provider
+
+
+def test_token_is_cached(make_server, make_token_provider):
+    server = make_server()
+    provider = make_token_provider(server)
+    assert provider.get_token() == "token-1"
+    assert provider.get_token() == "token-1"
+    assert server.token_requests == 1
+
+
+def test_invalidate_requests_a_new_token(make_server, make_token_provider):
+    server = make_server()
+    provider = make_token_provider(server)
+    provider.get_token()
+    provider.invalidate()
+    assert provider.get_token() == "token-2"
+
+
+def test_token_is_refreshed_before_it_expires(make_server, make_token_provider):
+    server = make_server(expires_in=30)
+    provider = make_token_provider(server, refresh_margin=60)
+    assert provider.get_token() == "token-1"
+    assert provider.get_token() == "token-2"
+
+
+def test_rejected_credentials_are_remembered(make_server, make_token_provider):
+    server = make_server(token_status=400)
+    provider = make_token_provider(server)
+    for _ in range(5):
+        with pytest.raises(TokenError):
+            provider.get_token()
+    assert server.token_requests == 1
+    assert get_breaker("identity").failures == 1
+
+
+def test_token_is_requested_again_after_the_failure_backoff(make_server, make_token_provider):
+    server = make_server(token_status=400)
+    provider = make_token_provider(server, failure_backoff=0)
+    for _ in range(2):
+        with pytest.raises(TokenError):
+            provider.get_token()
+    assert server.token_requests == 2
+
+
+def test_set_token_provider_returns_the_replaced_provider(make_server, make_token_provider):
+    provider = make_token_provider(make_server())
+    previous = set_token_provider("test", provider)
+    try:
+        assert get_token_provider("test") is provider
+    finally:
+        assert set_token_provider("test", previous) is provider
+    if previous is not None:
+        assert get_token_provider("test") is previous